@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import datetime
+import tempfile
+import subprocess
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+def load_county_geometry():
+	raw_data = json.loads(open(os.path.join(base_dir, 'data/us-county-info.json'), 'rb').read().decode('charmap'))
+	return raw_data["features"]
+
+def load_state_names():
+	raw_data = json.loads(open(os.path.join(base_dir, 'data/us-state-info.json')).read())
+	states = {}
+	for entry in raw_data["features"]:
+		states[entry["properties"]["STATE"]] = entry["properties"]["NAME"]
+	return states
+
+def synthesize_counties(count, states, features):
+	# Real counties are used first so that the state maps have geometry, additional
+	# counties beyond that are given unused FIPS codes within existing states
+	counties = []
+	for entry in features:
+		if entry["properties"]["STATE"] in states:
+			counties.append((entry["properties"]["STATE"] + entry["properties"]["COUNTY"],
+				entry["properties"]["NAME"]))
+	counties = counties[:count]
+	state_codes = sorted(states.keys())
+	extra = 0
+	while len(counties) < count:
+		state = state_codes[extra % len(state_codes)]
+		counties.append((f"{state}{900 + extra // len(state_codes):03d}", f"Synthetic {extra}"))
+		extra += 1
+	return counties
+
+def write_nyt_data(out_dir, days, counties, states):
+	first = datetime.date(2020, 3, 1)
+	dates = [(first + datetime.timedelta(days=day)).isoformat() for day in range(days)]
+	starts = [random.randint(0, max(days // 3, 1) - 1) for county in counties]
+	case_totals = [0] * len(counties)
+	death_totals = [0] * len(counties)
+	rows = 0
+	state_totals = {}
+	with open(os.path.join(out_dir, 'us-counties.csv'), 'w') as out:
+		out.write('date,county,state,fips,cases,deaths\n')
+		for day in range(days):
+			state_totals[day] = {}
+			for code in states.keys():
+				state_totals[day][code] = [0, 0]
+			for i in range(len(counties)):
+				if day < starts[i]:
+					continue
+				fips, name = counties[i]
+				case_totals[i] = max(case_totals[i] + random.randint(-2, 40), 0)
+				death_totals[i] += random.randint(0, 1)
+				out.write(f'{dates[day]},{name},{states[fips[:2]]},{fips},{case_totals[i]},{death_totals[i]}\n')
+				state_totals[day][fips[:2]][0] += case_totals[i]
+				state_totals[day][fips[:2]][1] += death_totals[i]
+				rows += 1
+
+	with open(os.path.join(out_dir, 'us-states.csv'), 'w') as out:
+		out.write('date,state,fips,cases,deaths\n')
+		for day in range(days):
+			for code in sorted(states.keys()):
+				cases, deaths = state_totals[day][code]
+				out.write(f'{dates[day]},{states[code]},{code},{cases},{deaths}\n')
+
+	with open(os.path.join(out_dir, 'us.csv'), 'w') as out:
+		out.write('date,cases,deaths')
+		for day in range(days):
+			cases = sum([totals[0] for totals in state_totals[day].values()])
+			deaths = sum([totals[1] for totals in state_totals[day].values()])
+			out.write(f'\n{dates[day]},{cases},{deaths}')
+	return rows
+
+def write_fdoh_data(out_dir, days, zip_count, features):
+	florida = [entry for entry in features if entry["properties"]["STATE"] == "12"]
+	counties = []
+	for entry in florida:
+		name = entry["properties"]["NAME"]
+		if name == "Miami-Dade":
+			name = "Dade"
+		if name == "DeSoto":
+			name = "Desoto"
+		if entry["geometry"]["type"] == "Polygon":
+			ring = entry["geometry"]["coordinates"][0]
+		else:
+			ring = entry["geometry"]["coordinates"][0][0]
+		counties.append((entry["properties"]["COUNTY"], name, ring[0]))
+
+	json.dump({"features": [{"attributes": {"COUNTY": county, "CasesAll": random.randint(1000, 50000),
+		"Deaths": random.randint(10, 500)}} for county, name, origin in counties]},
+		open(os.path.join(out_dir, 'fl-county-totals.json'), 'w'))
+
+	zips = []
+	info = []
+	for i in range(zip_count):
+		county, name, origin = counties[i % len(counties)]
+		zipcode = str(32000 + i)
+		x = origin[0] + (i // len(counties)) * 0.02
+		y = origin[1]
+		zips.append((zipcode, name))
+		info.append({"attributes": {"ZIP": zipcode, "COUNTYNAME": name, "Places": f"Place {zipcode}"},
+			"geometry": {"rings": [[[x, y], [x + 0.015, y], [x + 0.015, y + 0.015], [x, y + 0.015], [x, y]]]}})
+	# Some ZIP codes span several counties, so the first one is also listed under a second county
+	if len(zips) != 0 and len(counties) > 1:
+		county, name, origin = counties[1]
+		x = origin[0] - 0.02
+		y = origin[1]
+		zips.append((zips[0][0], name))
+		info.append({"attributes": {"ZIP": zips[0][0], "COUNTYNAME": name, "Places": f"Place {zips[0][0]}"},
+			"geometry": {"rings": [[[x, y], [x + 0.015, y], [x + 0.015, y + 0.015], [x, y + 0.015], [x, y]]]}})
+	json.dump({"features": info}, open(os.path.join(out_dir, 'fl-zip-info.json'), 'w'))
+
+	first = datetime.date(2020, 3, 1) + datetime.timedelta(days=max(days - 30, 0))
+	totals = [0] * len(zips)
+	for day in range(min(days, 30)):
+		date = (first + datetime.timedelta(days=day)).isoformat()
+		features = []
+		for i in range(len(zips)):
+			totals[i] += random.randint(0, 10)
+			if totals[i] < 5:
+				cases = "<5"
+			else:
+				cases = str(totals[i])
+			features.append({"attributes": {"ZIP": zips[i][0], "COUNTYNAME": zips[i][1], "Cases_1": cases}})
+		json.dump({"features": features}, open(os.path.join(out_dir, f'fl-zip-cases-{date}.json'), 'w'))
+
+def create_tree(path, days, county_count, zip_count):
+	os.makedirs(os.path.join(path, 'data'))
+	shutil.copy(os.path.join(base_dir, 'generate.py'), path)
+	shutil.copytree(os.path.join(base_dir, 'src'), os.path.join(path, 'src'))
+	shutil.copy(os.path.join(base_dir, 'data/us-county-info.json'), os.path.join(path, 'data'))
+	shutil.copy(os.path.join(base_dir, 'data/us-state-info.json'), os.path.join(path, 'data'))
+
+	features = load_county_geometry()
+	states = load_state_names()
+	counties = synthesize_counties(county_count, states, features)
+	rows = write_nyt_data(os.path.join(path, 'data'), days, counties, states)
+	write_fdoh_data(os.path.join(path, 'data'), days, zip_count, features)
+	return rows
+
+def run_build(path, jobs):
+	# Every run is a cold full build, so the ingest cache and output are removed first
+	for name in ["cache", "out", "out-builds"]:
+		if os.path.islink(os.path.join(path, name)):
+			os.remove(os.path.join(path, name))
+		elif os.path.exists(os.path.join(path, name)):
+			shutil.rmtree(os.path.join(path, name))
+	report = os.path.join(path, 'profile.json')
+	subprocess.run([sys.executable, os.path.join(path, 'generate.py'), '--jobs', str(jobs),
+		'--profile', report], check=True, stdout=subprocess.DEVNULL)
+	return json.loads(open(report).read())
+
+def summarize(reports, rows):
+	# Each phase keeps the fastest of the repeated runs
+	result = {"phases": {}, "peak_rss": min([report["peak_rss"] for report in reports]),
+		"peak_worker_rss": min([report["peak_worker_rss"] for report in reports])}
+	for name in reports[0]["phases"].keys():
+		best = min([report["phases"][name] for report in reports], key=lambda phase: phase["wall"])
+		items = best["items"]
+		if name == "import counties":
+			items = rows
+		if best["wall"] > 0:
+			throughput = items / best["wall"]
+		else:
+			throughput = 0
+		result["phases"][name] = {"wall": best["wall"], "cpu": best["cpu"], "items": items,
+			"throughput": throughput, "peak_rss": best["peak_rss"]}
+	return result
+
+def compare(result, baseline, threshold):
+	regressions = []
+	print(f"{'phase':<28} {'items':>8} {'wall s':>9} {'items/s':>11} {'baseline s':>11} {'change':>8}")
+	for name, phase in result["phases"].items():
+		line = f"{name:<28} {phase['items']:>8} {phase['wall']:>9.3f} {phase['throughput']:>11.0f}"
+		if baseline is not None and name in baseline["phases"] and baseline["phases"][name]["wall"] > 0:
+			before = baseline["phases"][name]["wall"]
+			change = (phase["wall"] - before) / before
+			line += f" {before:>11.3f} {change * 100:>+7.1f}%"
+			# Very short phases are too noisy to be reported as regressions
+			if change > threshold and phase["wall"] - before > 0.05:
+				regressions.append(name)
+		print(line)
+	print(f"\npeak RSS {result['peak_rss'] / 1048576:.1f} MB, workers {result['peak_worker_rss'] / 1048576:.1f} MB")
+	if baseline is not None:
+		change = (result["peak_rss"] - baseline["peak_rss"]) / baseline["peak_rss"]
+		print(f"baseline peak RSS {baseline['peak_rss'] / 1048576:.1f} MB ({change * 100:+.1f}%)")
+		if change > threshold:
+			regressions.append("peak RSS")
+	return regressions
+
+parser = argparse.ArgumentParser(description="Benchmark generate.py against synthetic data sets")
+parser.add_argument("--days", type=int, default=120, help="number of days of history")
+parser.add_argument("--counties", type=int, default=3221, help="number of counties")
+parser.add_argument("--zips", type=int, default=1000, help="number of Florida ZIP codes")
+parser.add_argument("--jobs", type=int, default=1, help="worker processes passed to generate.py")
+parser.add_argument("--repeat", type=int, default=3, help="number of builds to take the best time from")
+parser.add_argument("--seed", type=int, default=1, help="random seed for the synthetic data")
+parser.add_argument("--baseline", default=os.path.join(base_dir, "benchmark-baseline.json"),
+	help="baseline results to compare against")
+parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+parser.add_argument("--threshold", type=float, default=0.1,
+	help="relative slowdown against the baseline that counts as a regression")
+parser.add_argument("--keep", metavar="DIR", help="build in DIR and keep it instead of a temporary directory")
+args = parser.parse_args()
+
+random.seed(args.seed)
+scale = {"days": args.days, "counties": args.counties, "zips": args.zips, "jobs": args.jobs}
+if args.keep is not None:
+	if os.path.exists(args.keep):
+		shutil.rmtree(args.keep)
+	path = args.keep
+else:
+	temp_dir = tempfile.TemporaryDirectory()
+	path = os.path.join(temp_dir.name, "site")
+
+print(f"Generating {args.days} days x {args.counties} counties x {args.zips} ZIPs")
+rows = create_tree(path, args.days, args.counties, args.zips)
+reports = []
+for run in range(args.repeat):
+	print(f"Build {run + 1} of {args.repeat}")
+	reports.append(run_build(path, args.jobs))
+result = summarize(reports, rows)
+result["scale"] = scale
+
+baseline = None
+if os.path.exists(args.baseline):
+	baseline = json.loads(open(args.baseline).read())
+	if baseline["scale"] != scale:
+		print(f"Baseline was recorded at a different scale ({baseline['scale']}), not comparing")
+		baseline = None
+
+print()
+regressions = compare(result, baseline, args.threshold)
+if args.save_baseline:
+	open(args.baseline, 'w').write(json.dumps(result, indent=1))
+	print(f"Saved baseline to {args.baseline}")
+if len(regressions) > 0:
+	print(f"Regressions: {', '.join(regressions)}")
+	sys.exit(1)
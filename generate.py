@@ -1,150 +1,300 @@
 #!/usr/bin/env python3
 import string
+import copy
 import os
 import json
 import time
 import glob
 import shutil
+import hashlib
+import argparse
+import filecmp
+import multiprocessing
+import contextlib
+import sys
+import traceback
+import array
+import datetime
+import functools
+import gzip
+import numpy as np
 import png
 
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+# Only used to report memory use in profiles, it does not exist on Windows
+try:
+	import resource
+except ImportError:
+	resource = None
+
 base_dir = os.path.dirname(__file__)
+first_day = datetime.date(2020, 1, 1).toordinal()
+ingest_cache_version = 2
+geometry_cache_version = 2
+data_api_version = 1
+fl_zip_history_version = 2
+heat_map_steps = 1024
+fl_zip_history_row = np.dtype([("zip", "<i4"), ("day", "<i4"), ("cases", "<i4")])
+# Maximum deviation in pixels allowed when simplifying map outlines
+simplify_tolerance = 0.5
+# Precompressed output formats, brotli above quality 5 is much slower for little gain on these pages
+output_formats = ["gz", "br"]
+brotli_quality = 5
+# Files written together with an output that is tracked by fingerprint, and removed with it
+companion_outputs = {"county-map.png": ["county-map-hit.png", "county-map.json"]}
+
+state_list = ['Minnesota', 'Indiana', 'Alabama', 'Maryland', 'Washington', 'New Hampshire',
+	'Mississippi', 'New York', 'Arizona', 'Delaware', 'Wyoming', 'Montana', 'North Carolina',
+	'Florida', 'North Dakota', 'West Virginia', 'Oklahoma', 'Illinois', 'Vermont', 'Iowa',
+	'Wisconsin', 'New Mexico', 'California', 'District of Columbia', 'Missouri', 'Virginia',
+	'Louisiana', 'Utah', 'Michigan', 'Connecticut', 'Arkansas', 'Nevada', 'Idaho', 'Ohio',
+	'Texas', 'South Dakota', 'Kansas', 'Rhode Island', 'Massachusetts', 'New Jersey',
+	'Tennessee', 'Pennsylvania', 'Oregon', 'Kentucky', 'Colorado', 'Georgia', 'South Carolina',
+	'Maine', 'Nebraska']
+
+templates = {}
+active_site = None
+# Directory pages are written to, the staging directory of the build in progress
+out_dir = os.path.join(base_dir, "out")
 
 class DataPoint(object):
-	def __init__(self, date, case_total, death_total):
-		self.date = date
+	__slots__ = ("day", "case_total", "death_total")
+
+	def __init__(self, day, case_total, death_total):
+		self.day = day
 		self.case_total = case_total
 		self.death_total = death_total
-		self.case_increase = None
-		self.death_increase = None
-		self.case_increase_average = None
-		self.death_increase_average = None
 
 	def __repr__(self):
-		return f"{self.date}: {self.case_total} ({self.case_increase}), {self.death_total} ({self.death_increase})"
+		return f"{date_for_day(self.day)}: {self.case_total}, {self.death_total}"
+
+def compute_metrics(case_totals, death_totals):
+	# Series are right-aligned into one 2-D array with zero padding on the left, so that
+	# the difference against the padding gives the initial increase and the rolling
+	# average of the first week only counts days that exist.
+	lengths = np.array([len(series) for series in case_totals], dtype=np.int64)
+	width = int(lengths.max(initial=0)) + 7
+	cases = np.zeros((len(case_totals), width), dtype=np.int64)
+	deaths = np.zeros((len(death_totals), width), dtype=np.int64)
+	for row in range(len(case_totals)):
+		if lengths[row] != 0:
+			cases[row, width - lengths[row]:] = case_totals[row]
+			deaths[row, width - lengths[row]:] = death_totals[row]
+
+	case_increases = np.maximum(cases[:, 7:] - cases[:, 6:-1], 0)
+	death_increases = np.maximum(deaths[:, 7:] - deaths[:, 6:-1], 0)
+	case_averages = np.maximum((cases[:, 7:] - cases[:, :-7]) / 7.0, 0)
+	death_averages = np.maximum((deaths[:, 7:] - deaths[:, :-7]) / 7.0, 0)
+
+	rows = np.arange(len(case_totals))
+	# Empty series start past the last column, they are all padding and compare against it
+	start = np.minimum(width - lengths, width - 1)
+	week_start = np.maximum(width - 8, start)
+	two_week_start = np.maximum(width - 15, start)
+	cases_this_week = np.maximum(cases[:, -1] - cases[rows, week_start], 0)
+	deaths_this_week = np.maximum(deaths[:, -1] - deaths[rows, week_start], 0)
+	cases_last_two_weeks = np.maximum(cases[:, -1] - cases[rows, two_week_start], 0)
+	deaths_last_two_weeks = np.maximum(deaths[:, -1] - deaths[rows, two_week_start], 0)
+
+	out = []
+	for row in range(len(case_totals)):
+		first = width - 7 - lengths[row]
+		metrics = {"case_totals": cases[row, first + 7:], "death_totals": deaths[row, first + 7:],
+			"case_increases": case_increases[row, first:], "death_increases": death_increases[row, first:],
+			"case_averages": case_averages[row, first:], "death_averages": death_averages[row, first:],
+			"cases_this_week": int(cases_this_week[row]), "deaths_this_week": int(deaths_this_week[row]),
+			"cases_last_two_weeks": int(cases_last_two_weeks[row]),
+			"deaths_last_two_weeks": int(deaths_last_two_weeks[row])}
+		out.append(metrics)
+	return out
+
+def build_data_sets(series, late_start = False):
+	# Each series is a (days, case_totals, death_totals) tuple of parallel arrays
+	with profiler.phase("data sets") as phase:
+		keys = list(series.keys())
+		metrics = compute_metrics([series[key][1] for key in keys], [series[key][2] for key in keys])
+		out = {}
+		for i in range(len(keys)):
+			out[keys[i]] = DataSet(series[keys[i]][0], metrics[i]["case_totals"],
+				metrics[i]["death_totals"], late_start, metrics[i])
+		phase["items"] = len(keys)
+	return out
+
+def extend_metrics(totals, increases, averages, total):
+	# The arrays are views into the block shared by a batch of data sets, so they are
+	# extended by copying rather than in place
+	if len(totals) > 0:
+		previous = int(totals[-1])
+	else:
+		previous = 0
+	if len(totals) >= 7:
+		week_ago = int(totals[-7])
+	else:
+		week_ago = 0
+	totals = np.append(totals, total)
+	increases = np.append(increases, max(total - previous, 0))
+	averages = np.append(averages, max((total - week_ago) / 7.0, 0))
+	this_week = max(total - int(totals[max(len(totals) - 8, 0)]), 0)
+	last_two_weeks = max(total - int(totals[max(len(totals) - 15, 0)]), 0)
+	return totals, increases, averages, this_week, last_two_weeks
+
+@functools.lru_cache(maxsize=None)
+def day_for_date(date):
+	return datetime.date.fromisoformat(date).toordinal() - first_day
+
+@functools.lru_cache(maxsize=None)
+def date_for_day(day):
+	return datetime.date.fromordinal(day + first_day).isoformat()
+
+def lttb_indices(values, points):
+	# Largest-triangle-three-buckets: keeps the first and last value and from each bucket in
+	# between the one forming the largest triangle with the value kept before it and the
+	# mean of the next bucket, which keeps the peaks and troughs of the curve
+	count = len(values)
+	if points >= count or points < 3:
+		return list(range(count))
+	size = (count - 2) / (points - 2)
+	selected = [0]
+	for bucket in range(points - 2):
+		start = int(bucket * size) + 1
+		end = int((bucket + 1) * size) + 1
+		next_end = min(int((bucket + 2) * size) + 1, count)
+		mean_x = (end + next_end - 1) / 2
+		mean_y = sum(values[end:next_end]) / (next_end - end)
+		x = selected[-1]
+		y = values[x]
+		best = start
+		best_area = -1
+		for i in range(start, end):
+			area = abs((x - mean_x) * (values[i] - y) - (x - i) * (mean_y - y))
+			if area > best_area:
+				best = i
+				best_area = area
+		selected.append(best)
+	selected.append(count - 1)
+	return selected
+
+def downsample_series(increases, start, method, points):
+	# Returns the indices of the days kept and the value shown for each. Weekly buckets end
+	# on the latest day and show the mean daily increase, so both methods stay on the scale
+	# of the rolling average, which is taken unchanged at the kept days.
+	if method == "lttb":
+		values = increases[start:].tolist()
+		indices = [start + i for i in lttb_indices(values, points)]
+		return indices, [str(values[i - start]) for i in indices]
+	indices = list(range(len(increases) - 1, start - 1, -7))[::-1]
+	values = []
+	for end in indices:
+		week = increases[max(end - 6, start):end + 1]
+		values.append(f"{week.sum() / len(week):.1f}")
+	return indices, values
 
 class DataSet(object):
-	def __init__(self, data, late_start = False):
-		self.data = data
-		if len(self.data) == 0:
+	# Dates are kept as an array of day numbers since 2020-01-01 and only turned into
+	# strings for the days that are shown
+	def __init__(self, days, case_totals, death_totals, late_start = False, metrics = None):
+		if metrics is None:
+			metrics = compute_metrics([case_totals], [death_totals])[0]
+		self.days = np.asarray(days, dtype=np.int32)
+		self.late_start = late_start
+		self.case_totals = metrics["case_totals"]
+		self.death_totals = metrics["death_totals"]
+		self.case_increases = metrics["case_increases"]
+		self.death_increases = metrics["death_increases"]
+		self.case_averages = metrics["case_averages"]
+		self.death_averages = metrics["death_averages"]
+
+		# Late starting series have no known increase on the first day and no average
+		# for the first week
+		if late_start:
+			self.increase_start = 1
+			self.average_start = 7
+		else:
+			self.increase_start = 0
+			self.average_start = 0
+
+		if len(self.days) == 0:
 			self.case_total = 0
 			self.cases_today = 0
 			self.cases_this_week = 0
+			self.cases_last_two_weeks = 0
 			self.death_total = 0
 			self.deaths_today = 0
 			self.deaths_this_week = 0
+			self.deaths_last_two_weeks = 0
 			return
 
-		if late_start:
-			self.data[0].case_increase = None
-			self.data[0].death_increase = None
-		else:
-			self.data[0].case_increase = self.data[0].case_total
-			self.data[0].death_increase = self.data[0].death_total
-		for i in range(1, len(self.data)):
-			self.data[i].case_increase = self.data[i].case_total - self.data[i - 1].case_total
-			self.data[i].death_increase = self.data[i].death_total - self.data[i - 1].death_total
-
-		if late_start:
-			avg_begin = 7
+		self.case_total = int(self.case_totals[-1])
+		self.death_total = int(self.death_totals[-1])
+		if len(self.days) > self.increase_start:
+			self.cases_today = int(self.case_increases[-1])
+			self.deaths_today = int(self.death_increases[-1])
 		else:
-			avg_begin = 0
-		for i in range(avg_begin, len(self.data)):
-			if i >= 7:
-				prev_cases = self.data[i - 7].case_total
-				prev_deaths = self.data[i - 7].death_total
-			else:
-				prev_cases = 0
-				prev_deaths = 0
-			self.data[i].case_increase_average = (self.data[i].case_total - prev_cases) / 7.0
-			self.data[i].death_increase_average = (self.data[i].death_total - prev_deaths) / 7.0
-
-		for i in range(0, len(self.data)):
-			if self.data[i].case_increase is not None and self.data[i].case_increase < 0:
-				self.data[i].case_increase = 0
-			if self.data[i].case_increase_average is not None and self.data[i].case_increase_average < 0:
-				self.data[i].case_increase_average = 0
-			if self.data[i].death_increase is not None and self.data[i].death_increase < 0:
-				self.data[i].death_increase = 0
-			if self.data[i].death_increase_average is not None and self.data[i].death_increase_average < 0:
-				self.data[i].death_increase_average = 0
-
-		self.case_total = self.data[-1].case_total
-		self.death_total = self.data[-1].death_total
-		self.cases_today = self.data[-1].case_increase
-		self.deaths_today = self.data[-1].death_increase
-		if self.cases_today is None:
 			self.cases_today = 0
-		if self.deaths_today is None:
 			self.deaths_today = 0
-		if len(self.data) > 7:
-			self.cases_this_week = self.data[-1].case_total - self.data[-8].case_total
-			self.deaths_this_week = self.data[-1].death_total - self.data[-8].death_total
-		else:
-			self.cases_this_week = self.data[-1].case_total - self.data[0].case_total
-			self.deaths_this_week = self.data[-1].death_total - self.data[0].death_total
-		if len(self.data) > 14:
-			self.cases_last_two_weeks = self.data[-1].case_total - self.data[-15].case_total
-			self.deaths_last_two_weeks = self.data[-1].death_total - self.data[-15].death_total
-		else:
-			self.cases_last_two_weeks = self.data[-1].case_total - self.data[0].case_total
-			self.deaths_last_two_weeks = self.data[-1].death_total - self.data[0].death_total
-		if self.cases_this_week < 0:
-			self.cases_this_week = 0
-		if self.cases_last_two_weeks < 0:
-			self.cases_last_two_weeks = 0
-		if self.deaths_this_week < 0:
-			self.deaths_this_week = 0
-		if self.deaths_last_two_weeks < 0:
-			self.deaths_last_two_weeks = 0
+		self.cases_this_week = metrics["cases_this_week"]
+		self.deaths_this_week = metrics["deaths_this_week"]
+		self.cases_last_two_weeks = metrics["cases_last_two_weeks"]
+		self.deaths_last_two_weeks = metrics["deaths_last_two_weeks"]
+
+	def append(self, day, case_total, death_total):
+		# Adds one day to the series, only the metrics that involve the new day are computed
+		# instead of the whole history
+		self.days = np.append(self.days, np.int32(day))
+		self.case_totals, self.case_increases, self.case_averages, self.cases_this_week, \
+			self.cases_last_two_weeks = extend_metrics(self.case_totals, self.case_increases,
+			self.case_averages, case_total)
+		self.death_totals, self.death_increases, self.death_averages, self.deaths_this_week, \
+			self.deaths_last_two_weeks = extend_metrics(self.death_totals, self.death_increases,
+			self.death_averages, death_total)
+		self.case_total = int(case_total)
+		self.death_total = int(death_total)
+		if len(self.days) > self.increase_start:
+			self.cases_today = int(self.case_increases[-1])
+			self.deaths_today = int(self.death_increases[-1])
+
+	def __len__(self):
+		return len(self.days)
 
 	def __repr__(self):
-		return repr(self.data)
+		return f"DataSet({self.days.tolist()!r}, {self.case_totals.tolist()!r}, {self.death_totals.tolist()!r}, {self.late_start!r})"
 
-	def generate_case_graph(self, name, height):
-		template = string.Template(open(os.path.join(base_dir, 'src/graph.template.html'), 'r').read())
-		replacements = {"name": name, "label": "Cases", "height": str(height),
-			"color": "128, 198, 233"}
-		dates = []
-		values = []
-		averages = []
-		for pt in self.data:
-			if pt.date < "2020-03-15":
-				continue
-			if pt.case_increase is None:
-				continue
-			dates.append(pt.date)
-			values.append(str(pt.case_increase))
-			if pt.case_increase_average is None:
-				averages.append("undefined")
-			else:
-				averages.append(f"{pt.case_increase_average:.1f}")
-		replacements["dates"] = ','.join([f'"{i}"' for i in dates])
-		replacements["values"] = ','.join(values)
-		replacements["averages"] = ','.join(averages)
-		return template.substitute(replacements)
-
-	def generate_death_graph(self, name, height):
-		template = string.Template(open(os.path.join(base_dir, 'src/graph.template.html'), 'r').read())
-		replacements = {"name": name, "label": "Deaths", "height": str(height),
-			"color": "222, 143, 151"}
-		dates = []
-		values = []
-		averages = []
-		for pt in self.data:
-			if pt.date < "2020-03-15":
-				continue
-			if pt.death_increase is None:
-				continue
-			dates.append(pt.date)
-			values.append(str(pt.death_increase))
-			if pt.death_increase_average is None:
-				averages.append("undefined")
+	def generate_graph(self, name, height, label, color, increases, averages, charts, downsample = None,
+			points = 0):
+		start = max(int(np.searchsorted(self.days, day_for_date("2020-03-15"))), self.increase_start)
+		if downsample == "weekly" or (downsample == "lttb" and len(self.days) - start > points):
+			indices, values = downsample_series(increases, start, downsample, points)
+			days = self.days[indices].tolist()
+		else:
+			indices = range(start, len(self.days))
+			values = list(map(str, increases[start:].tolist()))
+			days = self.days[start:].tolist()
+		average_values = []
+		for i in indices:
+			if i < self.average_start:
+				average_values.append("undefined" if charts is None else "null")
 			else:
-				averages.append(f"{pt.death_increase_average:.1f}")
-		replacements["dates"] = ','.join([f'"{i}"' for i in dates])
+				average_values.append(f"{averages[i]:.1f}")
+		replacements = {"name": name, "label": label, "height": str(height), "color": color}
+		if charts is not None:
+			charts.add(name, label, color, days, values, average_values)
+			return templates['graph-lazy.template.html'].render(replacements)
+		replacements["dates"] = ','.join([f'"{date_for_day(day)}"' for day in days])
 		replacements["values"] = ','.join(values)
-		replacements["averages"] = ','.join(averages)
-		return template.substitute(replacements)
+		replacements["averages"] = ','.join(average_values)
+		return templates['graph.template.html'].render(replacements)
+
+	def generate_case_graph(self, name, height, charts = None, downsample = None, points = 0):
+		return self.generate_graph(name, height, "Cases", "128, 198, 233",
+			self.case_increases, self.case_averages, charts, downsample, points)
+
+	def generate_death_graph(self, name, height, charts = None, downsample = None, points = 0):
+		return self.generate_graph(name, height, "Deaths", "222, 143, 151",
+			self.death_increases, self.death_averages, charts, downsample, points)
 
 	def case_count_description(self):
 		total = self.case_total
@@ -152,7 +302,7 @@ class DataSet(object):
 			total_label = "case"
 		else:
 			total_label = "cases"
-		if len(self.data) == 1:
+		if len(self) == 1:
 			return f"{total} {total_label} total"
 		day = self.cases_today
 		if day == 1:
@@ -200,22 +350,399 @@ class DataSet(object):
 			week_percent = f"+{(week * 100.0) / (total - week):.2f}%"
 		return f"{total} {total_label} total, {day} {day_label} today ({day_percent}), {week} {week_label} this week ({week_percent})"
 
-def generate_page(title, src, out, replacements):
+class Region(object):
+	# A state or county in the region index, which the pages read names and series from.
+	# States list their counties with data and the counties on their map, counties name
+	# their state and Florida counties list their ZIP codes.
+	def __init__(self, code, name, data_set, state = None):
+		self.code = code
+		self.name = name
+		self.data_set = data_set
+		self.state = state
+		self.counties = []
+		self.map_counties = []
+		self.zips = []
+		self.zip_cases = {}
+		self.zip_polys = {}
+
+class Profiler(object):
+	# Accumulates wall time, CPU time, peak RSS and item counts per named phase. Phases
+	# may nest, in which case the inner phase's time is also part of the outer one.
+	def __init__(self, enabled):
+		self.enabled = enabled
+		self.phases = {}
+		self.pages = {}
+
+	@contextlib.contextmanager
+	def phase(self, name):
+		counters = {"items": 0}
+		if not self.enabled:
+			yield counters
+			return
+		wall = time.perf_counter()
+		cpu = time.process_time()
+		try:
+			yield counters
+		finally:
+			self.record(name, time.perf_counter() - wall, time.process_time() - cpu, counters["items"])
+
+	def record(self, name, wall, cpu, items, calls = 1, peak_rss = None):
+		if peak_rss is None:
+			peak_rss = peak_rss_bytes()
+		if name not in self.phases:
+			self.phases[name] = {"calls": 0, "items": 0, "wall": 0.0, "cpu": 0.0, "peak_rss": 0}
+		phase = self.phases[name]
+		phase["calls"] += calls
+		phase["items"] += items
+		phase["wall"] += wall
+		phase["cpu"] += cpu
+		phase["peak_rss"] = max(phase["peak_rss"], peak_rss)
+
+	def merge(self, phases):
+		for name, phase in phases.items():
+			self.record(name, phase["wall"], phase["cpu"], phase["items"], phase["calls"], phase["peak_rss"])
+
+	def record_page(self, kind, rendered, wall, cpu):
+		if kind not in self.pages:
+			self.pages[kind] = {"pages": 0, "rendered": 0, "wall": 0.0, "cpu": 0.0}
+		page = self.pages[kind]
+		page["pages"] += 1
+		if rendered:
+			page["rendered"] += 1
+		page["wall"] += wall
+		page["cpu"] += cpu
+
+	def report(self):
+		return {"phases": self.phases, "pages": self.pages,
+			"peak_rss": peak_rss_bytes(),
+			"peak_worker_rss": peak_rss_bytes(True)}
+
+	def summary(self):
+		lines = [f"{'phase':<28} {'calls':>7} {'items':>8} {'wall s':>9} {'cpu s':>9} {'peak MB':>8}"]
+		for name, phase in self.phases.items():
+			lines.append(f"{name:<28} {phase['calls']:>7} {phase['items']:>8} {phase['wall']:>9.3f} "
+				f"{phase['cpu']:>9.3f} {phase['peak_rss'] / 1048576:>8.1f}")
+		lines.append("")
+		lines.append(f"{'page type':<28} {'pages':>7} {'rendered':>8} {'wall s':>9} {'cpu s':>9}")
+		for kind, page in self.pages.items():
+			lines.append(f"{kind:<28} {page['pages']:>7} {page['rendered']:>8} {page['wall']:>9.3f} {page['cpu']:>9.3f}")
+		return '\n'.join(lines)
+
+def peak_rss_bytes(children = False):
+	# ru_maxrss is in kilobytes on Linux but in bytes on macOS
+	if resource is None:
+		return 0
+	if children:
+		peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+	else:
+		peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == 'darwin':
+		return peak
+	return peak * 1024
+
+class ChartData(object):
+	# Collects the series of every graph on a page into one JSON block with a shared
+	# date axis, from which charts.js creates each chart once it scrolls into view
+	def __init__(self):
+		self.series = []
+
+	def add(self, name, label, color, days, values, averages):
+		self.series.append((name, label, color, days, values, averages))
+
+	def render(self):
+		days = sorted(set([day for series in self.series for day in series[3]]))
+		day_index = {}
+		for i in range(len(days)):
+			day_index[days[i]] = i
+		entries = []
+		for name, label, color, series_days, values, averages in self.series:
+			entry = f'{json.dumps(name)}:{{"label":{json.dumps(label)},"color":{json.dumps(color)},'
+			if len(series_days) == 0:
+				entry += '"start":0,'
+			else:
+				start = day_index[series_days[0]]
+				if days[start:start + len(series_days)] == series_days:
+					entry += f'"start":{start},'
+				else:
+					entry += f'"indices":[{",".join([str(day_index[day]) for day in series_days])}],'
+			entry += f'"values":[{",".join(values)}],"averages":[{",".join(averages)}]}}'
+			entries.append(entry)
+		out = '<script type="application/json" id="chart-data">'
+		dates = [date_for_day(day) for day in days]
+		out += f'{{"dates":{json.dumps(dates, separators=(",", ":"))},"series":{{{",".join(entries)}}}}}'
+		out += '</script>\n<script src="charts.js"></script>\n'
+		return out
+
+class TooltipTable(object):
+	# Collects the numbers shown in the tooltip of each region on a page into one JSON
+	# block, from which tooltip.js formats the text of the region under the pointer
+	def __init__(self):
+		self.regions = {}
+		self.links = {}
+
+	def add(self, key, title, data_set, with_deaths):
+		entry = [title, len(data_set) == 1, data_set.case_total, data_set.cases_today, data_set.cases_this_week]
+		if with_deaths:
+			entry += [data_set.death_total, data_set.deaths_today, data_set.deaths_this_week]
+		self.regions[key] = entry
+
+	def render(self):
+		out = '<div id="tooltip" style="position: absolute; display: none; background: #141414; border: 1px #808080; '
+		out += 'border-radius: 5px; padding: 5px; max-width: 350px;"></div>\n'
+		out += '<script type="application/json" id="tooltip-data">'
+		out += json.dumps({"regions": self.regions, "links": self.links}, separators=(",", ":"))
+		out += '</script>\n'
+		return out
+
+class CompiledTemplate(object):
+	# string.Template syntax, split once into literal text and placeholder names and
+	# turned into an equivalent str.format pattern for fast substitution
+	def __init__(self, name, text):
+		self.name = name
+		self.text = text
+		self.literals = []
+		self.fields = []
+		literal = ""
+		pos = 0
+		for match in string.Template.pattern.finditer(text):
+			literal += text[pos:match.start()]
+			pos = match.end()
+			if match.group('escaped') is not None:
+				literal += string.Template.delimiter
+				continue
+			field = match.group('named') or match.group('braced')
+			if field is None:
+				raise ValueError(f"Invalid placeholder in template {name}")
+			self.literals.append(literal)
+			self.fields.append(field)
+			literal = ""
+		self.literals.append(literal + text[pos:])
+
+		pattern = ""
+		for i in range(len(self.fields)):
+			pattern += self.literals[i].replace('{', '{{').replace('}', '}}') + '{' + self.fields[i] + '}'
+		self.pattern = pattern + self.literals[-1].replace('{', '{{').replace('}', '}}')
+
+	def render(self, replacements):
+		with profiler.phase("templates") as phase:
+			phase["items"] = 1
+			return self.pattern.format_map(replacements)
+
+	def write(self, out, replacements):
+		# Replacements may be strings or lists of chunks, which are streamed to the output
+		# file as they are rather than being joined into one large string first
+		for i in range(len(self.fields)):
+			out.write(self.literals[i])
+			value = replacements[self.fields[i]]
+			if isinstance(value, str):
+				out.write(value)
+			else:
+				out.writelines(value)
+		out.write(self.literals[-1])
+
+def load_templates():
+	out = {}
+	for path in sorted(glob.glob(os.path.join(base_dir, 'src/*.html'))):
+		name = os.path.basename(path)
+		out[name] = CompiledTemplate(name, open(path, 'r').read())
+	return out
+
+def generate_page(title, src, out, replacements, charts = None, compress = (), tooltips = None):
 	replacements["title"] = title
-	template = string.Template(open(os.path.join(base_dir, "src", src)).read())
-	out = os.path.join(base_dir, "out", out)
-	open(out, 'w').write(template.substitute(replacements))
+	if charts is None:
+		replacements["chart_data"] = ""
+	else:
+		replacements["chart_data"] = charts.render()
+	if tooltips is not None:
+		replacements["chart_data"] += tooltips.render()
+	with profiler.phase("write pages") as phase:
+		phase["items"] = 1
+		# Files are replaced rather than rewritten, as they may be hard links into the live build
+		path = os.path.join(out_dir, out)
+		with open(path + ".tmp", 'w') as page:
+			templates[src].write(page, replacements)
+		os.replace(path + ".tmp", path)
+	compress_output(out, compress)
 
-def import_us_total_case_data():
-	raw_data = open(os.path.join(base_dir, 'data/us.csv'), 'r').read().split('\n')[1:]
-	out = []
+def compress_output(out, formats):
+	# Writes precompressed siblings that the web server can send as they are. The content
+	# hash they were made from is kept in the cache, so unchanged files are not compressed
+	# again.
+	if len(formats) == 0:
+		return
+	with profiler.phase("compress") as phase:
+		path = os.path.join(out_dir, out)
+		content = open(path, 'rb').read()
+		digest = hashlib.sha256(content).hexdigest()
+		hash_path = os.path.join(base_dir, "cache/compressed", out + ".sha256")
+		if os.path.exists(hash_path) and open(hash_path).read() == digest and \
+				all([os.path.exists(f"{path}.{format}") for format in formats]):
+			return
+		phase["items"] = 1
+		for format in formats:
+			if format == "gz":
+				data = gzip.compress(content, 9, mtime=0)
+			else:
+				data = brotli.compress(content, quality=brotli_quality)
+			open(f"{path}.{format}.tmp", 'wb').write(data)
+			os.replace(f"{path}.{format}.tmp", f"{path}.{format}")
+		os.makedirs(os.path.dirname(hash_path), exist_ok=True)
+		open(hash_path, 'w').write(digest)
+
+def compute_fingerprint(*inputs):
+	h = hashlib.sha256()
+	for item in inputs:
+		h.update(repr(item).encode('utf-8'))
+	return h.hexdigest()
+
+def load_fingerprints():
+	path = os.path.join(base_dir, "cache/fingerprints.json")
+	if not os.path.exists(path):
+		return {}
+	return json.loads(open(path).read())
+
+def save_fingerprints(fingerprints):
+	os.makedirs(os.path.join(base_dir, "cache"), exist_ok=True)
+	path = os.path.join(base_dir, "cache/fingerprints.json")
+	open(path + ".tmp", 'w').write(json.dumps(fingerprints, sort_keys=True))
+	os.replace(path + ".tmp", path)
+
+def load_map_assets():
+	path = os.path.join(base_dir, "cache/map-assets.json")
+	if not os.path.exists(path):
+		return {}
+	return json.loads(open(path).read())
+
+def save_map_assets(map_assets):
+	os.makedirs(os.path.join(base_dir, "cache"), exist_ok=True)
+	path = os.path.join(base_dir, "cache/map-assets.json")
+	open(path + ".tmp", 'w').write(json.dumps(map_assets, sort_keys=True))
+	os.replace(path + ".tmp", path)
+
+def copy_if_changed(src, out, compress = ()):
+	src = os.path.join(base_dir, src)
+	path = os.path.join(out_dir, out)
+	if not os.path.exists(path) or not filecmp.cmp(src, path, shallow=False):
+		shutil.copy(src, path + ".tmp")
+		os.replace(path + ".tmp", path)
+	compress_output(out, compress)
+
+def delta_encode(values):
+	return np.diff(values, prepend=0).tolist()
+
+def write_data_shard(out, data_set, compress = ()):
+	# A region's series for the data API. Days count from 2020-01-01, the date axis shared by
+	# every shard. Totals are delta encoded, as the first total followed by the change from
+	# the day before, which keeps the numbers short.
+	shard = {}
+	days = data_set.days
+	if len(days) == 0 or days[-1] - days[0] == len(days) - 1:
+		shard["start"] = int(days[0]) if len(days) != 0 else 0
+	else:
+		shard["days"] = delta_encode(days)
+	shard["cases"] = delta_encode(data_set.case_totals)
+	shard["deaths"] = delta_encode(data_set.death_totals)
+	path = os.path.join(out_dir, "api", out)
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	open(path + ".tmp", 'w').write(json.dumps(shard, separators=(",", ":")))
+	os.replace(path + ".tmp", path)
+	compress_output(f"api/{out}", compress)
+
+def load_ingest_cache(name, parse):
+	# Parsed sources are kept as a JSON index plus .npy arrays that are memory mapped
+	# back in, and are reparsed only when the size or modification time of the source
+	# file changes
+	path = os.path.join(base_dir, "data", name)
+	stat = os.stat(path)
+	source = [ingest_cache_version, stat.st_size, stat.st_mtime_ns]
+	cache_dir = os.path.join(base_dir, "cache/ingest", name)
+	index_path = os.path.join(cache_dir, "index.json")
+	if os.path.exists(index_path):
+		index = json.loads(open(index_path).read())
+		if index["source"] == source:
+			arrays = []
+			for i in range(index["arrays"]):
+				arrays.append(np.load(os.path.join(cache_dir, f"{i}.npy"), mmap_mode='r'))
+			return index["meta"], arrays
+
+	meta, arrays = parse(path)
+	os.makedirs(cache_dir, exist_ok=True)
+	if os.path.exists(index_path):
+		os.remove(index_path)
+	# Arrays are replaced rather than rewritten, as earlier loads may still map the old files
+	for i in range(len(arrays)):
+		array_path = os.path.join(cache_dir, f"{i}.npy")
+		with open(array_path + ".tmp", 'wb') as out:
+			np.save(out, arrays[i])
+		os.replace(array_path + ".tmp", array_path)
+	open(index_path + ".tmp", 'w').write(json.dumps({"source": source, "meta": meta, "arrays": len(arrays)}))
+	os.replace(index_path + ".tmp", index_path)
+	return meta, arrays
+
+def pack_series(series):
+	# series maps key -> (days, case_totals, death_totals)
+	keys = list(series.keys())
+	lengths = [len(series[key][0]) for key in keys]
+	columns = []
+	for i in range(3):
+		columns.append(np.concatenate([np.zeros(0, dtype=np.int32)] +
+			[np.asarray(series[key][i], dtype=np.int32) for key in keys]))
+	return {"keys": keys, "lengths": lengths}, columns
+
+def unpack_series(meta, columns):
+	out = {}
+	offset = 0
+	for key, length in zip(meta["keys"], meta["lengths"]):
+		out[key] = (columns[0][offset:offset + length], columns[1][offset:offset + length],
+			columns[2][offset:offset + length])
+		offset += length
+	return out
+
+def pack_polygons(polys):
+	keys = list(polys.keys())
+	ring_counts = [len(polys[key]) for key in keys]
+	point_counts = []
+	points = []
+	for key in keys:
+		for poly in polys[key]:
+			point_counts.append(len(poly))
+			for pt in poly:
+				points.append((pt[0], pt[1]))
+	return {"keys": keys, "ring_counts": ring_counts}, [np.array(points, dtype=np.float64).reshape(-1, 2),
+		np.array(point_counts, dtype=np.int32)]
+
+def unpack_polygons(meta, arrays):
+	points, point_counts = arrays
+	out = {}
+	ring = 0
+	offset = 0
+	for key, ring_count in zip(meta["keys"], meta["ring_counts"]):
+		# Composite keys come back from the JSON index as lists
+		if isinstance(key, list):
+			key = tuple(key)
+		out[key] = []
+		for i in range(ring_count):
+			out[key].append(points[offset:offset + point_counts[ring]])
+			offset += int(point_counts[ring])
+			ring += 1
+	return out
+
+def parse_us_total_case_data(path):
+	raw_data = open(path, 'r').read().split('\n')[1:]
+	out = ([], [], [])
 	for line in raw_data:
 		date, cases, deaths = line.split(',')
-		out.append(DataPoint(date, int(cases), int(deaths)))
-	return DataSet(out)
+		out[0].append(day_for_date(date))
+		out[1].append(int(cases))
+		out[2].append(int(deaths))
+	return pack_series({"total": out})
 
-def import_us_state_data():
-	raw_data = open(os.path.join(base_dir, 'data/us-states.csv'), 'r').read().split('\n')[1:]
+def import_us_total_case_data():
+	meta, columns = load_ingest_cache('us.csv', parse_us_total_case_data)
+	return build_data_sets(unpack_series(meta, columns))["total"]
+
+def parse_us_state_data(path):
+	raw_data = open(path, 'r').read().split('\n')[1:]
 	state_mapping = {}
 	state_cases = {}
 	for line in raw_data:
@@ -225,81 +752,172 @@ def import_us_state_data():
 		if state not in state_mapping:
 			state_mapping[state] = fips
 		if state not in state_cases:
-			state_cases[state] = []
-		state_cases[state].append(DataPoint(date, int(cases), int(deaths)))
-	for state in state_cases.keys():
-		state_cases[state] = DataSet(state_cases[state])
-	return state_mapping, state_cases
+			state_cases[state] = ([], [], [])
+		state_cases[state][0].append(day_for_date(date))
+		state_cases[state][1].append(int(cases))
+		state_cases[state][2].append(int(deaths))
+	meta, columns = pack_series(state_cases)
+	meta["state_mapping"] = state_mapping
+	return meta, columns
 
-def import_us_county_data():
-	raw_data = open(os.path.join(base_dir, 'data/us-counties.csv'), 'r').read().split('\n')[1:]
+def import_us_state_data():
+	meta, columns = load_ingest_cache('us-states.csv', parse_us_state_data)
+	return meta["state_mapping"], build_data_sets(unpack_series(meta, columns))
+
+def parse_us_county_data(path):
+	# The county file is by far the largest input, so it is streamed line by line into
+	# compact per-county columns instead of being read into memory as a whole
 	county_mapping = {}
 	county_to_fips = {}
 	county_state = {}
-	county_cases = {}
-	for line in raw_data:
-		if len(line) == 0:
-			continue
-		date, county, state, fips, cases, deaths = line.split(',')
-		if county == "New York City":
-			fips = "36NYC"
-		if fips not in county_mapping:
-			county_mapping[fips] = county
-		if fips not in county_state:
-			county_state[fips] = state
-		if fips not in county_cases:
-			county_cases[fips] = []
-		if state not in county_to_fips:
-			county_to_fips[state] = {}
-		county_cases[fips].append(DataPoint(date, int(cases), int(deaths)))
-		county_to_fips[state][county] = fips
-	for fips in county_cases:
-		county_cases[fips] = DataSet(county_cases[fips])
-	return county_mapping, county_to_fips, county_state, county_cases
+	county_columns = {}
+	with open(path, 'r') as raw_data:
+		raw_data.readline()
+		for line in raw_data:
+			line = line.rstrip('\n')
+			if len(line) == 0:
+				continue
+			date, county, state, fips, cases, deaths = line.split(',')
+			if county == "New York City":
+				fips = "36NYC"
+			columns = county_columns.get(fips)
+			if columns is None:
+				columns = (array.array('i'), array.array('i'), array.array('i'))
+				county_columns[fips] = columns
+				county_mapping[fips] = county
+				county_state[fips] = state
+			if state not in county_to_fips:
+				county_to_fips[state] = {}
+			columns[0].append(day_for_date(date))
+			columns[1].append(int(cases))
+			columns[2].append(int(deaths))
+			county_to_fips[state][county] = fips
+	meta, columns = pack_series(county_columns)
+	meta["county_mapping"] = county_mapping
+	meta["county_to_fips"] = county_to_fips
+	meta["county_state"] = county_state
+	return meta, columns
+
+def import_us_county_data():
+	meta, columns = load_ingest_cache('us-counties.csv', parse_us_county_data)
+	county_cases = build_data_sets(unpack_series(meta, columns))
+	return meta["county_mapping"], meta["county_to_fips"], meta["county_state"], county_cases
 
 def import_latest_fl_county_totals():
 	raw_data = json.loads(open(os.path.join(base_dir, 'data/fl-county-totals.json')).read())
 	out = {}
 	for entry in raw_data["features"]:
 		out[f'12{entry["attributes"]["COUNTY"]}'] = DataPoint(
-			time.strftime('%Y-%m-%d'), int(entry["attributes"]["CasesAll"]),
+			day_for_date(time.strftime('%Y-%m-%d')), int(entry["attributes"]["CasesAll"]),
 			int(entry["attributes"]["Deaths"]))
 	return out
 
+def parse_fl_zip_case_data(path):
+	raw_data = json.loads(open(path).read())
+	zips = []
+	cases = []
+	for entry in raw_data["features"]:
+		zipcode = entry["attributes"]["ZIP"]
+		county = entry["attributes"]["COUNTYNAME"]
+		if county == "Dade":
+			county = "Miami-Dade"
+		if county == "Desoto":
+			county = "DeSoto"
+		zips.append([county, zipcode])
+		try:
+			cases.append(int(entry["attributes"]["Cases_1"]))
+		except:
+			cases.append(0)
+	return {"zips": zips}, [np.array(cases, dtype=np.int32)]
+
+def load_fl_zip_history():
+	# Daily ZIP snapshots are kept in an append-only store of one (zip, day, cases) row per
+	# ZIP per day, so only snapshots that are not in the store yet are parsed. When only the
+	# newest snapshot changed, as it does with each download during the day, its rows are
+	# dropped and it is parsed again. The store is rebuilt when an older snapshot changes or
+	# disappears, or an older one shows up.
+	store_dir = os.path.join(base_dir, "cache/fl-zip-history")
+	index_path = os.path.join(store_dir, "index.json")
+	rows_path = os.path.join(store_dir, "rows.bin")
+	snapshots = {}
+	for path in glob.glob(os.path.join(base_dir, 'data/fl-zip-cases-*.json')):
+		stat = os.stat(path)
+		snapshots[os.path.basename(path)[len('fl-zip-cases-'):-len('.json')]] = [stat.st_size, stat.st_mtime_ns]
+
+	index = None
+	if os.path.exists(index_path) and os.path.exists(rows_path):
+		index = json.loads(open(index_path).read())
+		if index["version"] != fl_zip_history_version:
+			index = None
+		elif os.path.getsize(rows_path) < index["rows"] * fl_zip_history_row.itemsize:
+			index = None
+		else:
+			latest = max(index["snapshots"].keys(), default="")
+			changed = [date for date, source in index["snapshots"].items() if snapshots.get(date) != source]
+			if changed == [latest] and latest in snapshots:
+				index["rows"] = index["offsets"].pop(latest)
+				del index["snapshots"][latest]
+			elif len(changed) != 0:
+				index = None
+		if index is not None and any([date < max(index["snapshots"].keys(), default="")
+				for date in snapshots.keys() if date not in index["snapshots"]]):
+			index = None
+	if index is None:
+		index = {"version": fl_zip_history_version, "zips": [], "snapshots": {}, "offsets": {}, "rows": 0}
+		mode = 'wb'
+	else:
+		mode = 'ab'
+
+	new_dates = sorted([date for date in snapshots.keys() if date not in index["snapshots"]])
+	if len(new_dates) != 0 or mode == 'wb':
+		zip_ids = {}
+		for i in range(len(index["zips"])):
+			zip_ids[tuple(index["zips"][i])] = i
+		os.makedirs(store_dir, exist_ok=True)
+		with open(rows_path, mode) as out:
+			# Drops rows written after the index was last saved
+			out.truncate(index["rows"] * fl_zip_history_row.itemsize)
+			for date in new_dates:
+				meta, arrays = parse_fl_zip_case_data(os.path.join(base_dir, f'data/fl-zip-cases-{date}.json'))
+				rows = np.zeros(len(meta["zips"]), dtype=fl_zip_history_row)
+				for i in range(len(meta["zips"])):
+					key = tuple(meta["zips"][i])
+					if key not in zip_ids:
+						zip_ids[key] = len(index["zips"])
+						index["zips"].append(list(key))
+					rows["zip"][i] = zip_ids[key]
+				rows["day"] = day_for_date(date)
+				rows["cases"] = arrays[0]
+				rows.tofile(out)
+				index["offsets"][date] = index["rows"]
+				index["rows"] += len(rows)
+				index["snapshots"][date] = snapshots[date]
+		open(index_path + ".tmp", 'w').write(json.dumps(index))
+		os.replace(index_path + ".tmp", index_path)
+
+	return index["zips"], np.fromfile(rows_path, dtype=fl_zip_history_row, count=index["rows"])
+
 def import_fl_zip_case_data():
-	dates = []
-	for filename in glob.glob(os.path.join(base_dir, 'data/fl-zip-cases-*.json')):
-		dates.append(filename[len(os.path.join(base_dir, 'data/fl-zip-cases-')):-len('.json')])
-	dates.sort()
+	zips, rows = load_fl_zip_history()
+	# Rows are appended by date, so a stable sort by ZIP gives each ZIP's history in order
+	order = np.argsort(rows["zip"], kind="stable")
+	zip_ids = rows["zip"][order]
+	days = rows["day"][order]
+	cases = rows["cases"][order]
+	ids, starts, counts = np.unique(zip_ids, return_index=True, return_counts=True)
+	series = {}
+	for zip_id, start, count in zip(ids.tolist(), starts.tolist(), counts.tolist()):
+		series[tuple(zips[zip_id])] = (days[start:start + count], cases[start:start + count], np.zeros(count, dtype=np.int32))
 
 	out = {}
-	for date in dates:
-		raw_data = json.loads(open(os.path.join(base_dir, f'data/fl-zip-cases-{date}.json')).read())
-		for entry in raw_data["features"]:
-			zipcode = entry["attributes"]["ZIP"]
-			county = entry["attributes"]["COUNTYNAME"]
-			if county == "Dade":
-				county = "Miami-Dade"
-			if county == "Desoto":
-				county = "DeSoto"
-			if county not in out:
-				out[county] = {}
-			if zipcode not in out[county]:
-				out[county][zipcode] = []
-			cases = 0
-			try:
-				cases = int(entry["attributes"]["Cases_1"])
-			except:
-				pass
-			out[county][zipcode].append(DataPoint(date, cases, 0))
-
-	for county in out.keys():
-		for zipcode in out[county].keys():
-			out[county][zipcode] = DataSet(out[county][zipcode], True)
+	for (county, zipcode), data_set in build_data_sets(series, True).items():
+		if county not in out:
+			out[county] = {}
+		out[county][zipcode] = data_set
 	return out
 
-def import_fl_zip_info():
-	raw_data = json.loads(open(os.path.join(base_dir, 'data/fl-zip-info.json')).read())
+def parse_fl_zip_info(path):
+	raw_data = json.loads(open(path).read())
 	zip_county = {}
 	zip_by_county = {}
 	zip_names = {}
@@ -312,16 +930,28 @@ def import_fl_zip_info():
 			county = "DeSoto"
 		if county not in zip_by_county:
 			zip_by_county[county] = []
-		if county not in zip_polys:
-			zip_polys[county] = {}
 		zip_county[entry["attributes"]["ZIP"]] = county
 		zip_by_county[county].append(entry["attributes"]["ZIP"])
 		zip_names[entry["attributes"]["ZIP"]] = entry["attributes"]["Places"]
-		zip_polys[county][entry["attributes"]["ZIP"]] = entry["geometry"]["rings"]
-	return zip_county, zip_by_county, zip_names, zip_polys
+		# ZIP codes that span several counties have an outline in each of them
+		zip_polys[(county, entry["attributes"]["ZIP"])] = entry["geometry"]["rings"]
+	meta, arrays = pack_polygons(zip_polys)
+	meta["zip_county"] = zip_county
+	meta["zip_by_county"] = zip_by_county
+	meta["zip_names"] = zip_names
+	return meta, arrays
 
-def import_state_info():
-	raw_data = json.loads(open(os.path.join(base_dir, 'data/us-state-info.json')).read())
+def import_fl_zip_info():
+	meta, arrays = load_ingest_cache('fl-zip-info.json', parse_fl_zip_info)
+	zip_polys = {}
+	for (county, zipcode), rings in unpack_polygons(meta, arrays).items():
+		if county not in zip_polys:
+			zip_polys[county] = {}
+		zip_polys[county][zipcode] = rings
+	return meta["zip_county"], meta["zip_by_county"], meta["zip_names"], zip_polys
+
+def parse_state_info(path):
+	raw_data = json.loads(open(path).read())
 	state_polys = {}
 	for entry in raw_data["features"]:
 		state = entry["properties"]["NAME"]
@@ -334,10 +964,13 @@ def import_state_info():
 		for poly in state_polys[state]:
 			for pt in poly:
 				pt[1] = pt[1] * 1.2
-	return state_polys
+	return pack_polygons(state_polys)
 
-def import_county_info():
-	raw_data = json.loads(open(os.path.join(base_dir, 'data/us-county-info.json'), 'rb').read().decode('charmap'))
+def import_state_info():
+	return unpack_polygons(*load_ingest_cache('us-state-info.json', parse_state_info))
+
+def parse_county_info(path):
+	raw_data = json.loads(open(path, 'rb').read().decode('charmap'))
 	county_polys = {}
 	for entry in raw_data["features"]:
 		county = entry["properties"]["STATE"] + entry["properties"]["COUNTY"]
@@ -350,46 +983,72 @@ def import_county_info():
 		for poly in county_polys[county]:
 			for pt in poly:
 				pt[1] = pt[1] * 1.2
-	return county_polys
+	return pack_polygons(county_polys)
+
+def import_county_info():
+	return unpack_polygons(*load_ingest_cache('us-county-info.json', parse_county_info))
 
 def generate_case_breakdown(title, target, data_set, graph):
 	if target is None:
-		template = string.Template(open(os.path.join(base_dir, 'src/breakdown-nolink.template.html'), 'r').read())
+		template = templates['breakdown-nolink.template.html']
 	else:
-		template = string.Template(open(os.path.join(base_dir, 'src/breakdown.template.html'), 'r').read())
+		template = templates['breakdown.template.html']
 	count = data_set.case_count_description()
 	replacements = {"title": title, "target": target, "count": count, "graph": graph}
-	return template.substitute(replacements)
+	return template.render(replacements)
 
 def generate_tooltip(name, title, data_set, with_deaths):
-	template = string.Template(open(os.path.join(base_dir, 'src/tooltip.template.html'), 'r').read())
 	count = data_set.case_count_description()
 	if with_deaths:
 		count += '<br/><br/>' + data_set.death_count_description()
 	replacements = {"name": name, "title": title, "count": count}
-	return template.substitute(replacements)
+	return templates['tooltip.template.html'].render(replacements)
 
-def generate_svg(colors, links, tooltips, polys, size):
-	name_list = list(colors.keys())
+def simplify_ring(points, tolerance):
+	# Douglas-Peucker simplification of a ring in pixel space. Closed rings are split at
+	# the point farthest from the start so that both halves have a proper baseline.
+	if tolerance < 0 or len(points) < 4:
+		return points
+	keep = np.zeros(len(points), dtype=bool)
+	keep[0] = True
+	keep[-1] = True
+	if np.array_equal(points[0], points[-1]):
+		far = int(np.argmax(np.hypot(points[:, 0] - points[0, 0], points[:, 1] - points[0, 1])))
+		keep[far] = True
+		stack = [(0, far), (far, len(points) - 1)]
+	else:
+		stack = [(0, len(points) - 1)]
+	while len(stack) > 0:
+		a, b = stack.pop()
+		if b - a < 2:
+			continue
+		dx = points[b, 0] - points[a, 0]
+		dy = points[b, 1] - points[a, 1]
+		rel_x = points[a + 1:b, 0] - points[a, 0]
+		rel_y = points[a + 1:b, 1] - points[a, 1]
+		length = np.hypot(dx, dy)
+		if length == 0:
+			dist = np.hypot(rel_x, rel_y)
+		else:
+			dist = np.abs(rel_x * dy - rel_y * dx) / length
+		i = int(np.argmax(dist))
+		if dist[i] > tolerance:
+			keep[a + 1 + i] = True
+			stack.append((a, a + 1 + i))
+			stack.append((a + 1 + i, b))
+	return points[keep]
 
+def project_rings(polys, names, size, tolerance = simplify_tolerance):
+	# Projects the rings of each region into pixel space of at most size by size, as
+	# point arrays simplified to tolerance
 	width = size
 	height = size
 
-	min_x = polys[name_list[0]][0][0][0]
-	min_y = polys[name_list[0]][0][0][1]
-	max_x = min_x
-	max_y = min_y
-	for name in name_list:
-		for poly in polys[name]:
-			for pt in poly:
-				if pt[0] < min_x:
-					min_x = pt[0]
-				if pt[0] > max_x:
-					max_x = pt[0]
-				if pt[1] < min_y:
-					min_y = pt[1]
-				if pt[1] > max_y:
-					max_y = pt[1]
+	points = np.concatenate([np.asarray(poly, dtype=np.float64)[:, :2] for name in names for poly in polys[name]])
+	min_x = float(points[:, 0].min())
+	max_x = float(points[:, 0].max())
+	min_y = float(points[:, 1].min())
+	max_y = float(points[:, 1].max())
 	if (max_x - min_x) > (max_y - min_y):
 		height = (width * (max_y - min_y)) / (max_x - min_x)
 	else:
@@ -399,244 +1058,894 @@ def generate_svg(colors, links, tooltips, polys, size):
 	y_offset = -min_y
 	y_factor = height / (max_y - min_y)
 
-	out = f'<svg version="1.1" baseProfile="full" width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg">\n'
-
-	for name in name_list:
+	rings = {}
+	for name in names:
+		rings[name] = []
 		for poly in polys[name]:
-			out += '<polygon points="'
-			for pt in poly:
-				out += f'{(pt[0] + x_offset) * x_factor:.2f},{height - ((pt[1] + y_offset) * y_factor):.2f} '
-			out += f'" fill="{colors[name]}" stroke="#282828" stroke-width="2" '
+			poly = np.asarray(poly, dtype=np.float64)
+			ring = np.column_stack(((poly[:, 0] + x_offset) * x_factor,
+				height - ((poly[:, 1] + y_offset) * y_factor)))
+			rings[name].append(simplify_ring(ring, tolerance))
+	return width, height, rings
+
+def project_map(polys, names, size):
+	width, height, rings = project_rings(polys, names, size)
+	polygons = {}
+	for name in names:
+		polygons[name] = [''.join([f'{x:.2f},{y:.2f} ' for x, y in ring.tolist()]) for ring in rings[name]]
+	return {"width": width, "height": height, "polygons": polygons}
+
+def fill_ring(ids, ring, value):
+	# Even-odd scanline fill sampled at pixel centres. Each edge is tested against every
+	# scanline the ring covers at once, then the crossings are filled between in pairs.
+	height, width = ids.shape
+	x0 = ring[:, 0]
+	y0 = ring[:, 1]
+	x1 = np.roll(x0, -1)
+	y1 = np.roll(y0, -1)
+	top = max(int(np.floor(y0.min())), 0)
+	bottom = min(int(np.ceil(y0.max())), height)
+	if bottom <= top:
+		return
+	rows = np.arange(top, bottom) + 0.5
+	crosses = ((y0[:, None] <= rows) & (y1[:, None] > rows)) | ((y1[:, None] <= rows) & (y0[:, None] > rows))
+	edges, lines = np.nonzero(crosses)
+	xs = x0[edges] + (rows[lines] - y0[edges]) * (x1[edges] - x0[edges]) / (y1[edges] - y0[edges])
+	order = np.lexsort((xs, lines))
+	lines = lines[order]
+	xs = np.ceil(xs[order] - 0.5).astype(np.int64).clip(0, width)
+	for i in range(0, len(xs) - 1, 2):
+		ids[top + lines[i], xs[i]:xs[i + 1]] = value
+
+def write_png(path, rows, width, height, alpha = False):
+	with open(path + ".tmp", 'wb') as out:
+		png.Writer(width, height, greyscale=False, alpha=alpha).write(out, rows)
+	os.replace(path + ".tmp", path)
+
+def map_geometry_key(source, names, size):
+	stat = os.stat(os.path.join(base_dir, "data", source))
+	return compute_fingerprint(geometry_cache_version, stat.st_size, stat.st_mtime_ns, names, size,
+		simplify_tolerance)
+
+def load_map_geometry(name, source, polys, names, size):
+	# Maps are projected into pixel space and simplified once, then reused until the
+	# source geometry or the set of regions on the map changes
+	key = map_geometry_key(source, names, size)
+	path = os.path.join(base_dir, "cache/geometry", f"{name.replace(' ', '_')}.json")
+	if os.path.exists(path):
+		geometry = json.loads(open(path).read())
+		if geometry["key"] == key:
+			return geometry
+	with profiler.phase("project maps") as phase:
+		geometry = project_map(polys, names, size)
+		phase["items"] = len(names)
+	geometry["key"] = key
+	geometry["name"] = name.replace(' ', '_')
+	os.makedirs(os.path.join(base_dir, "cache/geometry"), exist_ok=True)
+	open(path + ".tmp", 'w').write(json.dumps(geometry))
+	os.replace(path + ".tmp", path)
+	return geometry
+
+def generate_svg(colors, links, tooltips, geometry, delegated = False):
+	# Delegated maps only tag each polygon with its region, events are handled by one
+	# listener in tooltip.js
+	with profiler.phase("svg") as phase:
+		phase["items"] = len(colors)
+		width = geometry["width"]
+		height = geometry["height"]
+		out = [f'<svg version="1.1" baseProfile="full" width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg">\n']
+
+		for name in colors.keys():
+			attributes = f'" fill="{colors[name]}" stroke="#282828" stroke-width="2" '
+			if delegated:
+				attributes += f'data-region="{name}" '
 			if name in tooltips:
-				out += f'onmousemove="showTooltip(evt, \'{tooltips[name]}\');" '
-				out += f'onmouseout="hideTooltip(\'{tooltips[name]}\');" '
+				attributes += f'onmousemove="showTooltip(evt, \'{tooltips[name]}\');" '
+				attributes += f'onmouseout="hideTooltip(\'{tooltips[name]}\');" '
 			if name in links:
-				out += f'onclick="document.location.href = \'{links[name]}\';" '
-			out += '/>\n'
+				attributes += f'onclick="document.location.href = \'{links[name]}\';" '
+			attributes += '/>\n'
+			for points in geometry["polygons"][name]:
+				out.append('<polygon points="')
+				out.append(points)
+				out.append(attributes)
 
-	out += '</svg>\n'
+		out.append('</svg>\n')
 	return out
 
-def interpolate_color(a, b, frac):
-	r = (a[0] * (1 - frac)) + (b[0] * frac)
-	g = (a[1] * (1 - frac)) + (b[1] * frac)
-	b = (a[2] * (1 - frac)) + (b[2] * frac)
-	return f'#{int(r):02x}{int(g):02x}{int(b):02x}'
-
-def color_for_value(value, max_value):
-	if value == 0:
-		return "#484848"
-	value_frac = value / max_value
-	if value_frac <= 0.1:
-		return interpolate_color((72, 72, 72), (128, 198, 233), value_frac / 0.1)
-	elif value_frac <= 0.5:
-		return interpolate_color((128, 198, 233), (237, 223, 179), (value_frac - 0.1) / 0.4)
-	else:
-		return interpolate_color((237, 223, 179), (222, 143, 151), (value_frac - 0.5) / 0.5)
+def write_map_asset(geometry, compress = ()):
+	# Map outlines are written once to a file named after the hash of their content, so
+	# that browsers can cache them for good and pages only carry the colours of each region
+	with profiler.phase("map assets") as phase:
+		width = geometry["width"]
+		height = geometry["height"]
+		svg = [f'<svg version="1.1" baseProfile="full" width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg">\n']
+		for name, polygons in geometry["polygons"].items():
+			for points in polygons:
+				svg.append(f'<polygon points="{points}" fill="#484848" stroke="#282828" stroke-width="2" data-region="{name}"/>\n')
+		svg.append('</svg>\n')
+		content = ''.join(svg).encode('utf-8')
+		out = f"maps/{geometry['name']}-{hashlib.sha256(content).hexdigest()[:16]}.svg"
+		path = os.path.join(out_dir, out)
+		if not os.path.exists(path):
+			phase["items"] = 1
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			# Workers may write the same map at the same time, each through its own file
+			open(f"{path}.{os.getpid()}.tmp", 'wb').write(content)
+			os.replace(f"{path}.{os.getpid()}.tmp", path)
+	compress_output(out, compress)
+	return out
+
+def generate_map_reference(asset, colors, links, tooltips, geometry):
+	table = {"colors": colors, "links": links, "tooltips": tooltips}
+	out = [f'<div class="map" data-map="{asset}" style="display: inline-block; width: {geometry["width"]}px; height: {geometry["height"]}px">']
+	out.append(f'<script type="application/json">{json.dumps(table, separators=(",", ":"))}</script></div>\n')
+	out.append('<script src="maps.js"></script>\n')
+	return out
+
+def build_heat_map_palette():
+	# The colour ramp is computed once as RGB rows and matching hex strings, maps and the
+	# legend then only look up palette indices
+	fracs = np.linspace(0, 1, heat_map_steps)
+	stops = [0, 0.1, 0.5, 1]
+	ramp = [(72, 72, 72), (128, 198, 233), (237, 223, 179), (222, 143, 151)]
+	rgb = np.stack([np.interp(fracs, stops, [color[i] for color in ramp]) for i in range(3)],
+		axis=1).astype(np.uint8)
+	return rgb, [f'#{r:02x}{g:02x}{b:02x}' for r, g, b in rgb.tolist()]
+
+heat_map_rgb, heat_map_hex = build_heat_map_palette()
+
+def color_indices(values, max_value):
+	values = np.asarray(values, dtype=np.float64)
+	if max_value <= 0:
+		return np.zeros(len(values), dtype=np.intp)
+	return np.rint(np.clip(values / max_value, 0, 1) * (heat_map_steps - 1)).astype(np.intp)
+
+def colors_for_values(values, max_value):
+	return [heat_map_hex[i] for i in color_indices(values, max_value).tolist()]
 
 def generate_heat_map_legend():
-	pixels = []
-	for y in range(8):
-		row = ()
-		for x in range(400):
-			value = color_for_value(x, 399)
-			r = int(value[1:3], 16)
-			g = int(value[3:5], 16)
-			b = int(value[5:7], 16)
-			row += (r, g, b)
-		pixels.append(row)
-	out = open(os.path.join(base_dir, "out/heatmap.png"), 'wb')
-	png.Writer(400, 8, greyscale=False).write(out, pixels)
-
-total_cases = import_us_total_case_data()
-state_mapping, state_cases = import_us_state_data()
-county_mapping, county_to_fips, county_state, county_cases = import_us_county_data()
-latest_fl_county_cases = import_latest_fl_county_totals()
-fl_zip_cases = import_fl_zip_case_data()
-fl_zip_county, fl_zip_by_county, fl_zip_names, fl_zip_polys = import_fl_zip_info()
-state_polys = import_state_info()
-county_polys = import_county_info()
-
-state_counties = {}
-for state in state_cases.keys():
-	state_counties[state] = []
-	fips = state_mapping[state]
-	for county in county_mapping.keys():
-		if county.startswith(fips):
-			state_counties[state].append(county)
-
-# Compute latest Florida totals from county data
-latest_fl_case_total = 0
-latest_fl_death_total = 0
-for county in latest_fl_county_cases.values():
-	latest_fl_case_total += county.case_total
-	latest_fl_death_total += county.death_total
-
-# Update Florida case information with latest data from FDoH (NY Times data is one day behind)
-if latest_fl_case_total != state_cases["Florida"].case_total:
-	state_cases["Florida"].data.append(DataPoint(time.strftime('%Y-%m-%d'),
-		latest_fl_case_total, latest_fl_death_total))
-	state_cases["Florida"] = DataSet(state_cases["Florida"].data)
-	for county in latest_fl_county_cases.keys():
-		if county in county_cases:
-			county_cases[county].data.append(latest_fl_county_cases[county])
-			county_cases[county] = DataSet(county_cases[county].data)
-
-if os.path.exists(os.path.join(base_dir, "out")):
-	shutil.rmtree(os.path.join(base_dir, "out"))
-os.mkdir(os.path.join(base_dir, "out"))
-
-shutil.copy(os.path.join(base_dir, "src/style.css"), os.path.join(base_dir, "out/style.css"))
-shutil.copy(os.path.join(base_dir, "src/Chart.min.js"), os.path.join(base_dir, "out/Chart.min.js"))
-shutil.copy(os.path.join(base_dir, "src/Chart.min.css"), os.path.join(base_dir, "out/Chart.min.css"))
-shutil.copy(os.path.join(base_dir, "src/tooltip.js"), os.path.join(base_dir, "out/tooltip.js"))
-
-state_ranking = list(state_cases.keys())
-state_ranking.sort(key=lambda state: (state_cases[state].cases_this_week,
-	state_cases[state].case_total), reverse=True)
-
-replacements = {}
-replacements["us_count"] = (total_cases.case_count_description() + "<br/>" +
-	total_cases.death_count_description())
-replacements["us_graph"] = (total_cases.generate_case_graph("total", 200) + "<br/>" +
-	total_cases.generate_death_graph("total_deaths", 100))
-
-replacements["us_graph"] += "<hr/>"
-replacements["us_graph"] += '<div align="center"><h2>Cases this week by state</h2>'
-colors = {}
-links = {}
-tooltips = {}
-max_value = 0
-state_list = ['Minnesota', 'Indiana', 'Alabama', 'Maryland', 'Washington', 'New Hampshire',
-	'Mississippi', 'New York', 'Arizona', 'Delaware', 'Wyoming', 'Montana', 'North Carolina',
-	'Florida', 'North Dakota', 'West Virginia', 'Oklahoma', 'Illinois', 'Vermont', 'Iowa',
-	'Wisconsin', 'New Mexico', 'California', 'District of Columbia', 'Missouri', 'Virginia',
-	'Louisiana', 'Utah', 'Michigan', 'Connecticut', 'Arkansas', 'Nevada', 'Idaho', 'Ohio',
-	'Texas', 'South Dakota', 'Kansas', 'Rhode Island', 'Massachusetts', 'New Jersey',
-	'Tennessee', 'Pennsylvania', 'Oregon', 'Kentucky', 'Colorado', 'Georgia', 'South Carolina',
-	'Maine', 'Nebraska']
-for state in state_list:
-	value = state_cases[state].cases_this_week
-	if value > max_value:
-		max_value = value
-for state in state_list:
-	colors[state] = color_for_value(state_cases[state].cases_this_week, max_value)
-	links[state] = f'{state.replace(" ", "_")}.html'
-	tooltips[state] = f'state_tooltip_{state.replace(" ", "_")}'
-replacements["us_graph"] += f'0 <img src="heatmap.png"></img> {max_value}'
-replacements["us_graph"] += '<br/></br/>'
-replacements["us_graph"] += generate_svg(colors, links, tooltips, state_polys, 1000)
-replacements["us_graph"] += '</div>'
-
-state_graph = ""
-for state in state_ranking:
-	state_graph += generate_case_breakdown(state, f"{state.replace(' ', '_')}.html", state_cases[state],
-		state_cases[state].generate_case_graph(state.replace(' ', '_'), 150))
-	state_graph += generate_tooltip(f"state_tooltip_{state.replace(' ', '_')}", state,
-		state_cases[state], True)
-replacements["state_graph"] = state_graph
-generate_page("United States of America", "index.html", "index.html", replacements)
-
-for state in state_ranking:
-	county_ranking = state_counties[state]
-	county_ranking.sort(key=lambda county: (county_cases[county].cases_this_week,
-		county_cases[county].case_total), reverse=True)
-
-	replacements = {}
-	replacements["state_count"] = (state_cases[state].case_count_description() + "<br/>" +
-		state_cases[state].death_count_description())
-	replacements["state_graph"] = (state_cases[state].generate_case_graph("total", 200) + "<br/>" +
-		state_cases[state].generate_death_graph("total_deaths", 100))
-
-	if len(county_ranking) != 0:
-		replacements["state_graph"] += "<hr/>"
-		replacements["state_graph"] += '<div align="center"><h2>Cases this week by county</h2>'
-		colors = {}
-		links = {}
-		tooltips = {}
-		max_value = 0
-		county_list = []
-		for county in county_polys.keys():
-			if county.startswith(state_mapping[state]):
-				county_list.append(county)
-		for county in county_list:
-			if county in county_cases:
-				value = county_cases[county].cases_this_week
-				if value > max_value:
-					max_value = value
-		for county in county_list:
-			if county in county_cases:
-				cases = county_cases[county].cases_this_week
+	row = heat_map_rgb[color_indices(np.arange(400), 399)].reshape(-1)
+	pixels = [row] * 8
+	write_png(os.path.join(out_dir, "heatmap.png"), pixels, 400, 8)
+
+def start_staging(incremental):
+	# Each build is rendered into its own directory under out-builds. Incremental builds
+	# start from hard links to the files of the live build, so unchanged files are not copied.
+	staging = os.path.join(base_dir, "out-builds", str(time.time_ns()))
+	os.makedirs(staging)
+	live = os.path.join(base_dir, "out")
+	if incremental and os.path.isdir(live):
+		for root, dirs, files in os.walk(live):
+			target = os.path.join(staging, os.path.relpath(root, live))
+			for name in dirs:
+				os.makedirs(os.path.join(target, name), exist_ok=True)
+			for name in files:
+				os.link(os.path.join(root, name), os.path.join(target, name))
+	return staging
+
+def publish_staging(staging):
+	# out is a symbolic link to the live build and is swapped in one rename, the build it
+	# replaces is kept for requests still reading from it. Published builds are marked with
+	# a .published file next to them and only marked builds are removed, so the staging
+	# directory of another build that is still rendering is left alone.
+	live = os.path.join(base_dir, "out")
+	builds = os.path.join(base_dir, "out-builds")
+	name = os.path.basename(staging)
+	keep = [name]
+	if os.path.islink(live):
+		keep.append(os.path.basename(os.readlink(live)))
+	elif os.path.isdir(live):
+		# Output from before builds were staged is moved aside once
+		os.rename(live, os.path.join(builds, "0"))
+		keep.append("0")
+	for build in keep:
+		open(os.path.join(builds, f"{build}.published"), 'w').close()
+	link = os.path.join(base_dir, f"out.{name}.tmp")
+	os.symlink(os.path.relpath(staging, base_dir), link)
+	os.replace(link, live)
+	for marker in os.listdir(builds):
+		build = marker[:-len(".published")]
+		if marker.endswith(".published") and build not in keep:
+			if os.path.isdir(os.path.join(builds, build)):
+				shutil.rmtree(os.path.join(builds, build))
+			os.remove(os.path.join(builds, marker))
+
+def discard_staging():
+	# Removes the staging directory of a build that failed before it was published
+	global out_dir
+	if os.path.dirname(out_dir) == os.path.join(base_dir, "out-builds"):
+		shutil.rmtree(out_dir, ignore_errors=True)
+	out_dir = os.path.join(base_dir, "out")
+
+def source_for_file(name):
+	# Maps a file in data/ to the source that Site.load reads it into
+	if name == 'us.csv':
+		return "us"
+	if name == 'us-states.csv':
+		return "states"
+	if name == 'us-counties.csv':
+		return "counties"
+	if name == 'fl-county-totals.json':
+		return "fl county totals"
+	if name.startswith('fl-zip-cases-') and name.endswith('.json'):
+		return "fl zips"
+	if name == 'fl-zip-info.json':
+		return "fl zip info"
+	if name == 'us-state-info.json':
+		return "state geometry"
+	if name == 'us-county-info.json':
+		return "county geometry"
+	return None
+
+def data_file_state():
+	state = {}
+	for name in os.listdir(os.path.join(base_dir, "data")):
+		stat = os.stat(os.path.join(base_dir, "data", name))
+		state[name] = (stat.st_size, stat.st_mtime_ns)
+	return state
+
+def render_site_task(task):
+	# Workers are forked from the process holding the site, so only the task is sent
+	return active_site.render_task(task)
+
+profiler = Profiler(False)
+
+class Site(object):
+	# The build as separate load, compute and render steps. Loaded sources are kept, so a
+	# long running process only has to reload the sources whose data files changed.
+	def __init__(self, lazy_charts = False, compress = (), external_maps = False, county_map = False,
+			compact_tooltips = False, downsample = None, downsample_points = 60, data_api = False):
+		self.lazy_charts = lazy_charts
+		self.compact_tooltips = compact_tooltips
+		# Downsampling method of the small per-region graphs, the main graph of each page
+		# always shows every day
+		self.downsample = downsample
+		self.downsample_points = downsample_points
+		self.data_api = data_api
+		self.external_maps = external_maps
+		self.county_map = county_map
+		self.compress = compress
+		self.incremental = False
+		self.previous_fingerprints = {}
+		self.page_fingerprints = {}
+		self.previous_map_assets = {}
+		self.page_map_assets = {}
+		self.map_assets = []
+
+	def load(self, sources = None):
+		with profiler.phase("load templates") as phase:
+			templates.clear()
+			templates.update(load_templates())
+			phase["items"] = len(templates)
+
+		if sources is None or "us" in sources:
+			with profiler.phase("import us") as phase:
+				self.total_cases = import_us_total_case_data()
+				phase["items"] = 1
+		if sources is None or "states" in sources:
+			with profiler.phase("import states") as phase:
+				self.state_mapping, self.imported_state_cases = import_us_state_data()
+				phase["items"] = len(self.imported_state_cases)
+		if sources is None or "counties" in sources:
+			with profiler.phase("import counties") as phase:
+				self.county_mapping, self.county_to_fips, self.county_state, self.imported_county_cases = import_us_county_data()
+				phase["items"] = len(self.imported_county_cases)
+		if sources is None or "fl county totals" in sources:
+			with profiler.phase("import fl county totals") as phase:
+				self.latest_fl_county_cases = import_latest_fl_county_totals()
+				phase["items"] = len(self.latest_fl_county_cases)
+		if sources is None or "fl zips" in sources:
+			with profiler.phase("import fl zips") as phase:
+				self.fl_zip_cases = import_fl_zip_case_data()
+				phase["items"] = sum([len(zips) for zips in self.fl_zip_cases.values()])
+		if sources is None or "fl zip info" in sources:
+			with profiler.phase("import fl zip info") as phase:
+				self.fl_zip_county, self.fl_zip_by_county, self.fl_zip_names, self.fl_zip_polys = import_fl_zip_info()
+				phase["items"] = len(self.fl_zip_county)
+		if sources is None or "state geometry" in sources:
+			with profiler.phase("import state geometry") as phase:
+				self.state_polys = import_state_info()
+				phase["items"] = len(self.state_polys)
+		if sources is None or "county geometry" in sources:
+			with profiler.phase("import county geometry") as phase:
+				self.county_polys = import_county_info()
+				phase["items"] = len(self.county_polys)
+
+	def compute(self):
+		# Works on copies of the imported data sets, so that computing again after a
+		# partial reload does not apply the Florida update twice. Appending replaces the
+		# arrays of a data set, so a shallow copy is enough.
+		self.state_cases = dict(self.imported_state_cases)
+		self.county_cases = dict(self.imported_county_cases)
+
+		# Compute latest Florida totals from county data
+		latest_fl_case_total = 0
+		latest_fl_death_total = 0
+		for county in self.latest_fl_county_cases.values():
+			latest_fl_case_total += county.case_total
+			latest_fl_death_total += county.death_total
+
+		# Update Florida case information with latest data from FDoH (NY Times data is one day behind)
+		with profiler.phase("florida update") as phase:
+			if latest_fl_case_total != self.state_cases["Florida"].case_total:
+				phase["items"] = 1 + len([county for county in self.latest_fl_county_cases.keys() if county in self.county_cases])
+				self.state_cases["Florida"] = copy.copy(self.state_cases["Florida"])
+				self.state_cases["Florida"].append(day_for_date(time.strftime('%Y-%m-%d')), latest_fl_case_total,
+					latest_fl_death_total)
+				for county in self.latest_fl_county_cases.keys():
+					if county in self.county_cases:
+						latest = self.latest_fl_county_cases[county]
+						self.county_cases[county] = copy.copy(self.county_cases[county])
+						self.county_cases[county].append(latest.day, latest.case_total, latest.death_total)
+
+		self.build_regions()
+		self.state_ranking = list(self.state_cases.keys())
+		self.state_ranking.sort(key=lambda state: (self.state_cases[state].cases_this_week,
+			self.state_cases[state].case_total), reverse=True)
+
+	def build_regions(self):
+		# Indexes states and counties by FIPS code, counties belong to the state whose code
+		# starts their own
+		self.regions = {}
+		for state, fips in self.state_mapping.items():
+			self.regions[fips] = Region(fips, state, self.state_cases.get(state))
+		for county, name in self.county_mapping.items():
+			state = self.regions.get(county[:2])
+			region = Region(county, name, self.county_cases[county], self.county_state[county])
+			if state is not None:
+				state.counties.append(county)
+			if self.county_state[county] == "Florida" and name in self.fl_zip_by_county:
+				region.zips = self.fl_zip_by_county[name]
+				region.zip_cases = self.fl_zip_cases.get(name, {})
+				region.zip_polys = self.fl_zip_polys[name]
+			self.regions[county] = region
+		for county in self.county_polys.keys():
+			state = self.regions.get(county[:2])
+			if state is not None:
+				state.map_counties.append(county)
+
+	def render(self, incremental = False, jobs = 1):
+		global active_site, out_dir
+		# Any change to the generator or templates invalidates every page
+		self.build_fingerprint = compute_fingerprint(open(os.path.abspath(__file__), 'rb').read(), self.lazy_charts, self.compress,
+			self.external_maps, self.county_map, self.compact_tooltips, self.downsample, self.downsample_points,
+			self.data_api, *[template.text for template in templates.values()])
+		self.incremental = incremental
+		self.page_fingerprints = {}
+		self.page_map_assets = {}
+		if incremental:
+			self.previous_fingerprints = load_fingerprints()
+			self.previous_map_assets = load_map_assets()
+		else:
+			self.previous_fingerprints = {}
+			self.previous_map_assets = {}
+
+		with profiler.phase("prepare output"):
+			out_dir = start_staging(incremental)
+
+			copy_if_changed("src/style.css", "style.css", self.compress)
+			copy_if_changed("src/Chart.min.js", "Chart.min.js", self.compress)
+			copy_if_changed("src/Chart.min.css", "Chart.min.css", self.compress)
+			copy_if_changed("src/tooltip.js", "tooltip.js", self.compress)
+			copy_if_changed("src/charts.js", "charts.js", self.compress)
+			copy_if_changed("src/maps.js", "maps.js", self.compress)
+			copy_if_changed("src/county-map.js", "county-map.js", self.compress)
+
+		tasks = [("index", None)]
+		if self.county_map:
+			tasks.append(("county map", None))
+		tasks += [("state", state) for state in self.state_ranking]
+		tasks += [("county", county) for county in self.county_cases.keys()]
+		with profiler.phase("render pages") as phase:
+			if jobs > 1:
+				# Workers are forked after all data has been loaded, so they share it with this
+				# process instead of parsing it again
+				active_site = self
+				pool = multiprocessing.get_context("fork").Pool(jobs)
+				results = pool.imap(render_site_task, tasks, chunksize=8)
 			else:
-				cases = 0
-			colors[county] = color_for_value(cases, max_value)
-			links[county] = f'county-{county}.html'
-			tooltips[county] = f'county_tooltip_{county}'
-		replacements["state_graph"] += f'0 <img src="heatmap.png"></img> {max_value}'
-		replacements["state_graph"] += '<br/></br/>'
-		replacements["state_graph"] += generate_svg(colors, links, tooltips, county_polys, 800)
-		replacements["state_graph"] += '</div>'
-
-	county_graph = ""
-	for county in county_ranking:
-		county_graph += generate_case_breakdown(county_mapping[county], f"county-{county}.html", county_cases[county],
-			county_cases[county].generate_case_graph(f"county_{county}", 150))
-		county_graph += generate_tooltip(f"county_tooltip_{county}", county_mapping[county],
-			county_cases[county], True)
-	replacements["county_graph"] = county_graph
-	generate_page(state, "state.html", f"{state.replace(' ', '_')}.html", replacements)
-
-for county in county_cases.keys():
-	replacements = {}
-	replacements["county_count"] = (county_cases[county].case_count_description() + "<br/>" +
-		county_cases[county].death_count_description())
-	replacements["county_graph"] = (county_cases[county].generate_case_graph("total", 200) + "<br/>" +
-		county_cases[county].generate_death_graph("total_deaths", 100))
-	replacements["state"] = county_state[county]
-	replacements["state_link"] = f"{county_state[county].replace(' ', '_')}.html"
-
-	if county_state[county] == "Florida" and county_mapping[county] in fl_zip_by_county:
-		zip_available = fl_zip_by_county[county_mapping[county]]
-		zip_ranking = []
-		for zipcode in zip_available:
-			if len(fl_zip_cases[county_mapping[county]][zipcode].data) > 0:
-				zip_ranking.append(zipcode)
-		zip_ranking.sort(key=lambda zipcode: (fl_zip_cases[county_mapping[county]][zipcode].cases_this_week,
-			fl_zip_cases[county_mapping[county]][zipcode].case_total), reverse=True)
-
-		replacements["county_graph"] += "<hr/>"
-		replacements["county_graph"] += '<div align="center"><h2>Cases this week by ZIP code</h2>'
-		colors = {}
+				pool = None
+				results = map(self.render_task, tasks)
+			for out, fingerprint, stats in results:
+				self.page_fingerprints[out] = fingerprint
+				self.page_map_assets[out] = stats["map_assets"]
+				profiler.merge(stats["phases"])
+				profiler.record_page(stats["kind"], stats["rendered"], stats["wall"], stats["cpu"])
+			if pool is not None:
+				pool.close()
+				pool.join()
+				active_site = None
+			phase["items"] = len(tasks)
+
+		if self.data_api:
+			with profiler.phase("data api"):
+				self.write_data_manifest()
+
+		with profiler.phase("heat map legend"):
+			if not incremental or not os.path.exists(os.path.join(out_dir, "heatmap.png")):
+				generate_heat_map_legend()
+
+		# Remove pages for regions that no longer exist in the source data
+		with profiler.phase("cleanup"):
+			for out in self.previous_fingerprints.keys():
+				if out not in self.page_fingerprints:
+					for companion in [out] + companion_outputs.get(out, []):
+						for name in [companion] + [f"{companion}.{format}" for format in output_formats]:
+							if os.path.exists(os.path.join(out_dir, name)):
+								os.remove(os.path.join(out_dir, name))
+			# Map assets are hard linked forward from the live build, the ones no page refers
+			# to any more are removed
+			map_assets = set([asset for assets in self.page_map_assets.values() for asset in assets])
+			maps_dir = os.path.join(out_dir, "maps")
+			if os.path.isdir(maps_dir):
+				for name in os.listdir(maps_dir):
+					asset = f"maps/{name}"
+					for format in output_formats:
+						if asset.endswith(f".{format}"):
+							asset = asset[:-len(format) - 1]
+					if asset not in map_assets:
+						os.remove(os.path.join(maps_dir, name))
+
+		# Fingerprints are saved after the swap, so that they never describe pages that
+		# are not live yet
+		with profiler.phase("publish"):
+			publish_staging(out_dir)
+			out_dir = os.path.join(base_dir, "out")
+			save_fingerprints(self.page_fingerprints)
+			save_map_assets(self.page_map_assets)
+
+	def build(self, incremental = False, jobs = 1):
+		self.load()
+		self.compute()
+		self.render(incremental, jobs)
+
+	def write_data_manifest(self):
+		# Lists every region of the data API with the path of its shard, and removes the
+		# shards of regions that no longer exist
+		regions = {"us": {"name": "United States of America", "path": "us.json"}}
+		for state in self.state_ranking:
+			code = self.state_mapping[state]
+			regions[code] = {"name": self.regions[code].name, "path": f"states/{code}.json"}
+		for county in self.county_cases.keys():
+			region = self.regions[county]
+			entry = {"name": region.name, "state": region.state, "path": f"counties/{county}.json"}
+			if len(region.zips) != 0:
+				entry["zips"] = {}
+				for zipcode in region.zips:
+					entry["zips"][zipcode] = {"name": self.fl_zip_names[zipcode],
+						"path": f"counties/{county}/{zipcode}.json"}
+			regions[county] = entry
+		last_day = int(self.total_cases.days[-1]) if len(self.total_cases) != 0 else 0
+		manifest = {"version": data_api_version, "first_date": date_for_day(0), "last_date": date_for_day(last_day),
+			"regions": regions}
+
+		paths = set(["manifest.json"])
+		for entry in regions.values():
+			paths.add(entry["path"])
+			for zip_entry in entry.get("zips", {}).values():
+				paths.add(zip_entry["path"])
+		api_dir = os.path.join(out_dir, "api")
+		for root, dirs, files in os.walk(api_dir):
+			for name in files:
+				path = os.path.relpath(os.path.join(root, name), api_dir)
+				shard = path
+				for format in output_formats:
+					if path.endswith(f".{format}"):
+						shard = path[:-len(format) - 1]
+				if shard not in paths:
+					os.remove(os.path.join(root, name))
+
+		os.makedirs(api_dir, exist_ok=True)
+		path = os.path.join(api_dir, "manifest.json")
+		open(path + ".tmp", 'w').write(json.dumps(manifest, separators=(",", ":")))
+		os.replace(path + ".tmp", path)
+		compress_output("api/manifest.json", self.compress)
+
+	def render_map(self, colors, links, tooltips, geometry, table = None):
+		if table is not None:
+			table.links.update(links)
+			links = {}
+			tooltips = {}
+		if self.external_maps:
+			asset = write_map_asset(geometry, self.compress)
+			self.map_assets.append(asset)
+			return generate_map_reference(asset, colors, links, tooltips, geometry)
+		return generate_svg(colors, links, tooltips, geometry, table is not None)
+
+	def new_tooltip_table(self):
+		if self.compact_tooltips:
+			return TooltipTable()
+		return None
+
+	def new_chart_data(self):
+		if self.lazy_charts:
+			return ChartData()
+		return None
+
+	def page_is_current(self, out, fingerprint):
+		if not self.incremental:
+			return False
+		if self.previous_fingerprints.get(out) != fingerprint:
+			return False
+		# The map assets a page refers to are needed to keep them when unused ones are removed
+		if out not in self.previous_map_assets:
+			return False
+		return os.path.exists(os.path.join(out_dir, out))
+
+	def county_map_values(self):
+		county_list = []
+		for state in state_list:
+			if state in self.state_mapping:
+				county_list += self.regions[self.state_mapping[state]].map_counties
+		return county_list, self.county_values(county_list)
+
+	def render_county_map(self):
+		# The national county map is a raster image, with a second image that holds the
+		# number of the county under each pixel for hover and click handling in the page
+		county_list, values = self.county_map_values()
+		fingerprint = compute_fingerprint(self.build_fingerprint, county_list, values,
+			[(county, self.regions[county].name, self.regions[county].state) if county in self.regions else
+				(county, None, None) for county in county_list],
+			map_geometry_key('us-county-info.json', county_list, 1000))
+		if self.page_is_current("county-map.png", fingerprint):
+			return "county-map.png", fingerprint, False
+
+		with profiler.phase("county map") as phase:
+			phase["items"] = len(county_list)
+			# Outlines are not simplified, so that neighbouring counties leave no gaps
+			width, height, rings = project_rings(self.county_polys, county_list, 1000, -1)
+			width = int(np.ceil(width))
+			height = int(np.ceil(height))
+			ids = np.zeros((height, width), dtype=np.int32)
+			for i in range(len(county_list)):
+				for ring in rings[county_list[i]]:
+					fill_ring(ids, ring, i + 1)
+
+			max_value = max(values, default=0)
+			lookup = np.zeros((len(county_list) + 1, 4), dtype=np.uint8)
+			lookup[1:, :3] = heat_map_rgb[color_indices(values, max_value)]
+			lookup[1:, 3] = 255
+			image = lookup[ids]
+			# Pixels next to a different county are drawn as borders
+			border = np.zeros(ids.shape, dtype=bool)
+			border[:, 1:] |= ids[:, 1:] != ids[:, :-1]
+			border[1:, :] |= ids[1:, :] != ids[:-1, :]
+			image[border & (ids != 0)] = (40, 40, 40, 255)
+			write_png(os.path.join(out_dir, "county-map.png"), image.reshape(height, width * 4), width, height, True)
+
+			hit = np.zeros((height, width, 3), dtype=np.uint8)
+			hit[:, :, 0] = ids >> 8
+			hit[:, :, 1] = ids & 255
+			write_png(os.path.join(out_dir, "county-map-hit.png"), hit.reshape(height, width * 3), width, height)
+
+			table = []
+			for county, value in zip(county_list, values):
+				if county in self.regions:
+					table.append([county, f"{self.regions[county].name}, {self.regions[county].state}", value])
+				else:
+					table.append([None, None, 0])
+			path = os.path.join(out_dir, "county-map.json")
+			open(path + ".tmp", 'w').write(json.dumps(table, separators=(",", ":")))
+			os.replace(path + ".tmp", path)
+			compress_output("county-map.json", self.compress)
+		return "county-map.png", fingerprint, True
+
+	def render_index(self):
+		page_inputs = [self.build_fingerprint, self.total_cases, self.state_cases,
+			map_geometry_key('us-state-info.json', state_list, 1000)]
+		if self.county_map:
+			county_max_value = max(self.county_map_values()[1], default=0)
+			page_inputs.append(county_max_value)
+		fingerprint = compute_fingerprint(*page_inputs)
+		if self.page_is_current("index.html", fingerprint):
+			return "index.html", fingerprint, False
+
+		charts = self.new_chart_data()
+		tips = self.new_tooltip_table()
+		replacements = {}
+		replacements["us_count"] = (self.total_cases.case_count_description() + "<br/>" +
+			self.total_cases.death_count_description())
+		replacements["us_graph"] = [self.total_cases.generate_case_graph("total", 200, charts), "<br/>",
+			self.total_cases.generate_death_graph("total_deaths", 100, charts)]
+
+		replacements["us_graph"].append("<hr/>")
+		replacements["us_graph"].append('<div align="center"><h2>Cases this week by state</h2>')
 		links = {}
 		tooltips = {}
-		max_value = 0
-		for zipcode in zip_ranking:
-			value = fl_zip_cases[county_mapping[county]][zipcode].cases_this_week
-			if value > max_value:
-				max_value = value
-		for zipcode in fl_zip_by_county[county_mapping[county]]:
-			if zipcode in zip_ranking:
-				colors[zipcode] = color_for_value(fl_zip_cases[county_mapping[county]][zipcode].cases_this_week, max_value)
-				links[zipcode] = f'#zip{zipcode}'
-				tooltips[zipcode] = f'zip_tooltip_{zipcode}'
+		values = [self.regions[self.state_mapping[state]].data_set.cases_this_week for state in state_list]
+		max_value = max(values)
+		colors = dict(zip(state_list, colors_for_values(values, max_value)))
+		for state in state_list:
+			links[state] = f'{state.replace(" ", "_")}.html'
+			tooltips[state] = f'state_tooltip_{state.replace(" ", "_")}'
+		replacements["us_graph"].append(f'0 <img src="heatmap.png"></img> {max_value}')
+		replacements["us_graph"].append('<br/></br/>')
+		replacements["us_graph"].extend(self.render_map(colors, links, tooltips,
+			load_map_geometry("us", 'us-state-info.json', self.state_polys, state_list, 1000), tips))
+		replacements["us_graph"].append('</div>')
+		if self.county_map:
+			replacements["us_graph"].append("<hr/>")
+			replacements["us_graph"].append('<div align="center"><h2>Cases this week by county</h2>')
+			replacements["us_graph"].append(f'0 <img src="heatmap.png"></img> {county_max_value}')
+			replacements["us_graph"].append('<br/></br/>')
+			replacements["us_graph"].append('<img id="county-map" src="county-map.png" data-hit="county-map-hit.png" '
+				'data-table="county-map.json"></img></div>\n')
+			replacements["us_graph"].append('<div id="county-map-tooltip" style="position: absolute; display: none; '
+				'background: #141414; border: 1px #808080; border-radius: 5px; padding: 5px; max-width: 350px;"></div>\n')
+			replacements["us_graph"].append('<script src="county-map.js"></script>\n')
+
+		state_graph = []
+		for state in self.state_ranking:
+			data_set = self.regions[self.state_mapping[state]].data_set
+			state_graph.append(generate_case_breakdown(state, f"{state.replace(' ', '_')}.html", data_set,
+				data_set.generate_case_graph(state.replace(' ', '_'), 150, charts, self.downsample,
+				self.downsample_points)))
+			if tips is None:
+				state_graph.append(generate_tooltip(f"state_tooltip_{state.replace(' ', '_')}", state, data_set, True))
 			else:
-				colors[zipcode] = color_for_value(0, max_value)
-		replacements["county_graph"] += f'0 <img src="heatmap.png"></img> {max_value}'
-		replacements["county_graph"] += '<br/></br/>'
-		replacements["county_graph"] += generate_svg(colors, links, tooltips, fl_zip_polys[county_mapping[county]], 800)
-		replacements["county_graph"] += '</div>'
-
-		zip_graph = ""
-		for zipcode in zip_ranking:
-			zip_graph += f'<a name="zip{zipcode}"></a>'
-			zip_graph += generate_case_breakdown(f"{zipcode} - {fl_zip_names[zipcode]}", None,
-				fl_zip_cases[county_mapping[county]][zipcode],
-				fl_zip_cases[county_mapping[county]][zipcode].generate_case_graph(f"zip_{zipcode}", 150))
-			zip_graph += generate_tooltip(f"zip_tooltip_{zipcode}", f"{zipcode} - {fl_zip_names[zipcode]}",
-				fl_zip_cases[county_mapping[county]][zipcode], False)
-		replacements["zip_graph"] = zip_graph
-		generate_page(county_mapping[county], "fl-county.html", f"county-{county}.html", replacements)
-	else:
-		generate_page(county_mapping[county], "county.html", f"county-{county}.html", replacements)
+				tips.add(state, state, data_set, True)
+		replacements["state_graph"] = state_graph
+		if self.data_api:
+			write_data_shard("us.json", self.total_cases, self.compress)
+		generate_page("United States of America", "index.html", "index.html", replacements, charts, self.compress, tips)
+		return "index.html", fingerprint, True
+
+	def render_state_page(self, state):
+		region = self.regions[self.state_mapping[state]]
+		data_set = region.data_set
+		counties = [self.regions[county] for county in region.counties]
+		county_list = region.map_counties
+		out = f"{state.replace(' ', '_')}.html"
+		fingerprint = compute_fingerprint(self.build_fingerprint, state, data_set,
+			[(county.code, county.name, county.data_set) for county in counties],
+			[(county, self.regions[county].data_set if county in self.regions else None) for county in county_list],
+			map_geometry_key('us-county-info.json', county_list, 800))
+		if self.page_is_current(out, fingerprint):
+			return out, fingerprint, False
+
+		charts = self.new_chart_data()
+		tips = self.new_tooltip_table()
+		county_ranking = list(counties)
+		county_ranking.sort(key=lambda county: (county.data_set.cases_this_week, county.data_set.case_total),
+			reverse=True)
+
+		replacements = {}
+		replacements["state_count"] = (data_set.case_count_description() + "<br/>" +
+			data_set.death_count_description())
+		replacements["state_graph"] = [data_set.generate_case_graph("total", 200, charts), "<br/>",
+			data_set.generate_death_graph("total_deaths", 100, charts)]
+
+		if len(county_ranking) != 0:
+			replacements["state_graph"].append("<hr/>")
+			replacements["state_graph"].append('<div align="center"><h2>Cases this week by county</h2>')
+			links = {}
+			tooltips = {}
+			values = self.county_values(county_list)
+			max_value = max(values, default=0)
+			colors = dict(zip(county_list, colors_for_values(values, max_value)))
+			for county in county_list:
+				links[county] = f'county-{county}.html'
+				tooltips[county] = f'county_tooltip_{county}'
+			replacements["state_graph"].append(f'0 <img src="heatmap.png"></img> {max_value}')
+			replacements["state_graph"].append('<br/></br/>')
+			replacements["state_graph"].extend(self.render_map(colors, links, tooltips,
+				load_map_geometry(f"state-{region.code}", 'us-county-info.json', self.county_polys, county_list, 800), tips))
+			replacements["state_graph"].append('</div>')
+
+		county_graph = []
+		for county in county_ranking:
+			county_graph.append(generate_case_breakdown(county.name, f"county-{county.code}.html", county.data_set,
+				county.data_set.generate_case_graph(f"county_{county.code}", 150, charts, self.downsample,
+				self.downsample_points)))
+			if tips is None:
+				county_graph.append(generate_tooltip(f"county_tooltip_{county.code}", county.name,
+					county.data_set, True))
+			else:
+				tips.add(county.code, county.name, county.data_set, True)
+		replacements["county_graph"] = county_graph
+		if self.data_api:
+			write_data_shard(f"states/{region.code}.json", data_set, self.compress)
+		generate_page(state, "state.html", out, replacements, charts, self.compress, tips)
+		return out, fingerprint, True
+
+	def render_county_page(self, county):
+		out = f"county-{county}.html"
+		region = self.regions[county]
+		data_set = region.data_set
+		page_inputs = [self.build_fingerprint, region.name, region.state, data_set]
+		if len(region.zips) != 0:
+			zip_list = list(dict.fromkeys(region.zips))
+			page_inputs.append([(zipcode, self.fl_zip_names[zipcode], region.zip_cases[zipcode])
+				for zipcode in zip_list])
+			page_inputs.append(map_geometry_key('fl-zip-info.json', zip_list, 800))
+		fingerprint = compute_fingerprint(*page_inputs)
+		if self.page_is_current(out, fingerprint):
+			return out, fingerprint, False
+		if self.data_api:
+			write_data_shard(f"counties/{county}.json", data_set, self.compress)
+			for zipcode in dict.fromkeys(region.zips):
+				write_data_shard(f"counties/{county}/{zipcode}.json", region.zip_cases[zipcode], self.compress)
+
+		charts = self.new_chart_data()
+		tips = self.new_tooltip_table()
+		replacements = {}
+		replacements["county_count"] = (data_set.case_count_description() + "<br/>" +
+			data_set.death_count_description())
+		replacements["county_graph"] = [data_set.generate_case_graph("total", 200, charts), "<br/>",
+			data_set.generate_death_graph("total_deaths", 100, charts)]
+		replacements["state"] = region.state
+		replacements["state_link"] = f"{region.state.replace(' ', '_')}.html"
+
+		if len(region.zips) != 0:
+			zip_ranking = []
+			for zipcode in region.zips:
+				if len(region.zip_cases[zipcode]) > 0:
+					zip_ranking.append(zipcode)
+			zip_ranking.sort(key=lambda zipcode: (region.zip_cases[zipcode].cases_this_week,
+				region.zip_cases[zipcode].case_total), reverse=True)
+
+			replacements["county_graph"].append("<hr/>")
+			replacements["county_graph"].append('<div align="center"><h2>Cases this week by ZIP code</h2>')
+			links = {}
+			tooltips = {}
+			values = []
+			for zipcode in zip_list:
+				if zipcode in zip_ranking:
+					values.append(region.zip_cases[zipcode].cases_this_week)
+					links[zipcode] = f'#zip{zipcode}'
+					tooltips[zipcode] = f'zip_tooltip_{zipcode}'
+				else:
+					values.append(0)
+			max_value = max(values, default=0)
+			colors = dict(zip(zip_list, colors_for_values(values, max_value)))
+			replacements["county_graph"].append(f'0 <img src="heatmap.png"></img> {max_value}')
+			replacements["county_graph"].append('<br/></br/>')
+			replacements["county_graph"].extend(self.render_map(colors, links, tooltips,
+				load_map_geometry(f"zip-{county}", 'fl-zip-info.json', region.zip_polys, zip_list, 800), tips))
+			replacements["county_graph"].append('</div>')
+
+			zip_graph = []
+			for zipcode in zip_ranking:
+				zip_graph.append(f'<a name="zip{zipcode}"></a>')
+				zip_graph.append(generate_case_breakdown(f"{zipcode} - {self.fl_zip_names[zipcode]}", None,
+					region.zip_cases[zipcode],
+					region.zip_cases[zipcode].generate_case_graph(f"zip_{zipcode}", 150, charts, self.downsample,
+					self.downsample_points)))
+				if tips is None:
+					zip_graph.append(generate_tooltip(f"zip_tooltip_{zipcode}", f"{zipcode} - {self.fl_zip_names[zipcode]}",
+						region.zip_cases[zipcode], False))
+				else:
+					tips.add(zipcode, f"{zipcode} - {self.fl_zip_names[zipcode]}", region.zip_cases[zipcode], False)
+			replacements["zip_graph"] = zip_graph
+			generate_page(region.name, "fl-county.html", out, replacements, charts, self.compress, tips)
+		else:
+			generate_page(region.name, "county.html", out, replacements, charts, self.compress)
+		return out, fingerprint, True
+
+	def county_values(self, county_list):
+		# Cases this week of each county on a map, counties without data are drawn as zero
+		values = []
+		for county in county_list:
+			if county in self.regions:
+				values.append(self.regions[county].data_set.cases_this_week)
+			else:
+				values.append(0)
+		return values
+
+	def render_task(self, task):
+		# Phases recorded while rendering are returned with the result, so that they are not
+		# lost when the page is rendered in a worker process
+		kind, name = task
+		outer_phases = profiler.phases
+		profiler.phases = {}
+		wall = time.perf_counter()
+		cpu = time.process_time()
+		self.map_assets = []
+		if kind == "index":
+			out, fingerprint, rendered = self.render_index()
+		elif kind == "county map":
+			out, fingerprint, rendered = self.render_county_map()
+		elif kind == "state":
+			out, fingerprint, rendered = self.render_state_page(name)
+		else:
+			out, fingerprint, rendered = self.render_county_page(name)
+		if not rendered:
+			self.map_assets = self.previous_map_assets[out]
+		stats = {"kind": kind, "rendered": rendered, "wall": time.perf_counter() - wall,
+			"cpu": time.process_time() - cpu, "phases": profiler.phases, "map_assets": self.map_assets}
+		profiler.phases = outer_phases
+		return out, fingerprint, stats
+
+
+def write_profile(path):
+	if path is not None:
+		open(path, 'w').write(json.dumps(profiler.report(), indent=1))
+		print(profiler.summary())
+
+def watch(site, interval, jobs, profile):
+	# Polls data/ and rebuilds once a change has settled, reloading only the changed sources
+	# and rendering incrementally so that only the affected pages are written
+	previous = data_file_state()
+	while True:
+		time.sleep(interval)
+		current = data_file_state()
+		if current == previous:
+			continue
+		while True:
+			time.sleep(interval)
+			settled = data_file_state()
+			if settled == current:
+				break
+			current = settled
+		changed = sorted([name for name in set(previous.keys()) | set(current.keys())
+			if previous.get(name) != current.get(name)])
+		previous = current
+		sources = set([source_for_file(name) for name in changed])
+		sources.discard(None)
+		if len(sources) == 0:
+			continue
+
+		print(f"Rebuilding for changes to {', '.join(changed)}")
+		profiler.phases = {}
+		profiler.pages = {}
+		start = time.perf_counter()
+		try:
+			site.load(sources)
+			site.compute()
+			site.render(True, jobs)
+		except Exception:
+			# Keep the last good output and wait for the next change
+			traceback.print_exc()
+			discard_staging()
+			continue
+		print(f"Rebuilt in {time.perf_counter() - start:.1f}s")
+		write_profile(profile)
+
+def main():
+	global profiler
+	parser = argparse.ArgumentParser(description="Generate COVID-19 trend pages")
+	parser.add_argument("--incremental", action="store_true",
+		help="keep existing output and only regenerate pages whose inputs changed")
+	parser.add_argument("--lazy-charts", action="store_true",
+		help="ship the chart data of each page as one JSON block and create charts as they scroll into view")
+	parser.add_argument("--jobs", type=int, default=1,
+		help="number of worker processes used to render pages")
+	parser.add_argument("--profile", nargs="?", const="profile.json", metavar="REPORT",
+		help="record time, CPU and memory use of each build phase and write them to REPORT")
+	parser.add_argument("--external-maps", action="store_true",
+		help="write map outlines to shared cacheable SVG files and ship only region colours in each page")
+	parser.add_argument("--county-map", action="store_true",
+		help="add a raster map of every county to the index page")
+	parser.add_argument("--compact-tooltips", action="store_true",
+		help="use one tooltip per page filled from a table of region data instead of one hidden element per region")
+	parser.add_argument("--downsample", choices=["lttb", "weekly"],
+		help="reduce the small per-region graphs to the most significant days (lttb) or to weekly means")
+	parser.add_argument("--downsample-points", type=int, default=60, metavar="POINTS",
+		help="number of days kept in each small graph with --downsample lttb")
+	parser.add_argument("--data-api", action="store_true",
+		help="also write the series of every region as delta encoded JSON shards under api/ with a manifest")
+	parser.add_argument("--compress", default="", metavar="FORMATS",
+		help="comma separated list of precompressed siblings to write next to each output file (gz, br)")
+	parser.add_argument("--watch", action="store_true",
+		help="keep running after the build and rebuild the affected pages when files in data/ change")
+	parser.add_argument("--interval", type=float, default=5,
+		help="seconds between checks for changed data files in watch mode")
+	args = parser.parse_args()
+	compress = [format for format in args.compress.split(",") if len(format) != 0]
+	for format in compress:
+		if format not in output_formats:
+			parser.error(f"unknown compression format {format}")
+	if "br" in compress and brotli is None:
+		parser.error("brotli output requires the brotli package")
+
+	profiler = Profiler(args.profile is not None)
+	site = Site(args.lazy_charts, compress, args.external_maps, args.county_map, args.compact_tooltips,
+		args.downsample, args.downsample_points, args.data_api)
+	site.build(args.incremental, args.jobs)
+	write_profile(args.profile)
+	if args.watch:
+		watch(site, args.interval, args.jobs, args.profile)
 
-generate_heat_map_legend()
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,89 @@
+function createChart(canvas, data) {
+	let series = data.series[canvas.dataset.chart];
+	let labels;
+	if (series.indices) {
+		labels = series.indices.map(i => data.dates[i]);
+	} else {
+		labels = data.dates.slice(series.start, series.start + series.values.length);
+	}
+	new Chart(canvas.getContext('2d'), {
+		type: 'bar',
+		data: {
+			labels: labels,
+			datasets: [
+				{
+					label: series.label,
+					data: series.values,
+					order: 2,
+					backgroundColor: 'rgba(128, 128, 128, 0.4)'
+				},
+				{
+					label: 'Average ' + series.label,
+					data: series.averages,
+					type: 'line',
+					order: 1,
+					backgroundColor: 'rgba(' + series.color + ', 0.75)',
+					borderColor: 'rgba(' + series.color + ', 1)'
+				}
+			]
+		},
+		options: {
+			scales: {
+				xAxes: [{
+					ticks: {
+						display: false,
+					},
+					gridLines: {
+						drawTicks: false,
+						drawOnChartArea: false
+					}
+				}],
+				yAxes: [{
+					ticks: {
+						beginAtZero: true,
+						maxTicksLimit: 5,
+						precision: 0
+					},
+					gridLines: {
+						color: 'rgba(54, 54, 54, 1)'
+					},
+					scaleLabel: {
+						display: true,
+						labelString: series.label
+					}
+				}]
+			},
+			legend: {
+				display: false
+			},
+			maintainAspectRatio: false,
+			animation: {
+				duration: 0
+			}
+		}
+	});
+}
+
+function createCharts() {
+	let data = JSON.parse(document.getElementById('chart-data').textContent);
+	let canvases = document.querySelectorAll('canvas[data-chart]');
+	if (!('IntersectionObserver' in window)) {
+		canvases.forEach(canvas => createChart(canvas, data));
+		return;
+	}
+	let observer = new IntersectionObserver(function(entries) {
+		entries.forEach(function(entry) {
+			if (entry.isIntersecting) {
+				observer.unobserve(entry.target);
+				createChart(entry.target, data);
+			}
+		});
+	}, {rootMargin: '200px'});
+	canvases.forEach(canvas => observer.observe(canvas));
+}
+
+if (document.readyState === 'loading') {
+	document.addEventListener('DOMContentLoaded', createCharts);
+} else {
+	createCharts();
+}
@@ -0,0 +1,60 @@
+function loadCountyMap(map) {
+	let tooltip = document.getElementById('county-map-tooltip');
+	let hit = null;
+	let table = null;
+
+	// The hit image and county table are only downloaded once the pointer reaches the map
+	map.addEventListener('mouseenter', () => {
+		let image = new Image();
+		image.onload = () => {
+			let canvas = document.createElement('canvas');
+			canvas.width = image.naturalWidth;
+			canvas.height = image.naturalHeight;
+			hit = canvas.getContext('2d', { willReadFrequently: true });
+			hit.drawImage(image, 0, 0);
+		};
+		image.src = map.dataset.hit;
+		fetch(map.dataset.table).then(response => response.json()).then(data => { table = data; });
+	}, { once: true });
+
+	function countyAt(evt) {
+		if (hit === null || table === null) {
+			return null;
+		}
+		let x = Math.floor(evt.offsetX * map.naturalWidth / map.clientWidth);
+		let y = Math.floor(evt.offsetY * map.naturalHeight / map.clientHeight);
+		let pixel = hit.getImageData(x, y, 1, 1).data;
+		let id = pixel[0] * 256 + pixel[1];
+		if (id === 0 || table[id - 1][0] === null) {
+			return null;
+		}
+		return table[id - 1];
+	}
+
+	map.addEventListener('mousemove', evt => {
+		let county = countyAt(evt);
+		if (county === null) {
+			tooltip.style.display = 'none';
+			map.style.cursor = 'default';
+			return;
+		}
+		tooltip.textContent = county[1] + ': ' + county[2] + ' cases this week';
+		tooltip.style.display = 'block';
+		tooltip.style.left = evt.pageX + 16 + 'px';
+		tooltip.style.top = evt.pageY + 16 + 'px';
+		map.style.cursor = 'pointer';
+	});
+
+	map.addEventListener('mouseout', () => {
+		tooltip.style.display = 'none';
+	});
+
+	map.addEventListener('click', evt => {
+		let county = countyAt(evt);
+		if (county !== null) {
+			document.location.href = 'county-' + county[0] + '.html';
+		}
+	});
+}
+
+loadCountyMap(document.getElementById('county-map'));
@@ -0,0 +1,29 @@
+function applyMap(container, svg, data) {
+	container.innerHTML = svg;
+	for (let polygon of container.querySelectorAll('polygon')) {
+		let region = polygon.dataset.region;
+		if (region in data.colors) {
+			polygon.setAttribute('fill', data.colors[region]);
+		}
+		if (region in data.tooltips) {
+			let tooltip = data.tooltips[region];
+			polygon.addEventListener('mousemove', evt => showTooltip(evt, tooltip));
+			polygon.addEventListener('mouseout', () => hideTooltip(tooltip));
+		}
+		if (region in data.links) {
+			let link = data.links[region];
+			polygon.addEventListener('click', () => { document.location.href = link; });
+		}
+	}
+}
+
+function loadMaps() {
+	for (let container of document.querySelectorAll('div[data-map]')) {
+		let data = JSON.parse(container.querySelector('script').textContent);
+		let url = container.dataset.map;
+		container.removeAttribute('data-map');
+		fetch(url).then(response => response.text()).then(svg => applyMap(container, svg, data));
+	}
+}
+
+loadMaps();
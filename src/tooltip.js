@@ -9,3 +9,87 @@ function hideTooltip(name) {
 	let tooltip = document.getElementById(name);
 	tooltip.style.display = "none";
 }
+
+// Pages built with compact tooltips carry one table of region data, map polygons are
+// tagged with their region and handled by the listeners below
+let tooltipData;
+
+function regionTooltips() {
+	if (tooltipData === undefined) {
+		let element = document.getElementById('tooltip-data');
+		tooltipData = element === null ? null : JSON.parse(element.textContent);
+	}
+	return tooltipData;
+}
+
+function formatPercent(value) {
+	// Exact ties are rounded to even like the generator does, toFixed would round them up
+	if (Number.isInteger(value * 8) && (value * 1000) % 10 === 5) {
+		let hundredths = Math.floor(value * 100);
+		if (hundredths % 2 === 1) {
+			hundredths += 1;
+		}
+		return (hundredths / 100).toFixed(2);
+	}
+	return value.toFixed(2);
+}
+
+function describeCount(total, day, week, singular, plural) {
+	let label = count => count == 1 ? singular : plural;
+	let percent = count => (total - count) == 0 ? 'no previous' : '+' + formatPercent((count * 100.0) / (total - count)) + '%';
+	return total + ' ' + label(total) + ' total, ' + day + ' ' + label(day) + ' today (' + percent(day) + '), ' +
+		week + ' ' + label(week) + ' this week (' + percent(week) + ')';
+}
+
+function regionAt(evt) {
+	let data = regionTooltips();
+	if (data === null || evt.target.dataset === undefined) {
+		return null;
+	}
+	let region = evt.target.dataset.region;
+	if (region === undefined) {
+		return null;
+	}
+	return region;
+}
+
+document.addEventListener('mousemove', evt => {
+	let region = regionAt(evt);
+	if (region === null) {
+		return;
+	}
+	let tooltip = document.getElementById('tooltip');
+	let entry = regionTooltips().regions[region];
+	if (entry === undefined) {
+		tooltip.style.display = 'none';
+		return;
+	}
+	let [title, single, cases, casesToday, casesThisWeek] = entry;
+	let lines = [single ? cases + ' ' + (cases == 1 ? 'case' : 'cases') + ' total' :
+		describeCount(cases, casesToday, casesThisWeek, 'case', 'cases')];
+	if (entry.length > 5) {
+		lines.push(describeCount(entry[5], entry[6], entry[7], 'death', 'deaths'));
+	}
+	let heading = document.createElement('h3');
+	heading.textContent = title;
+	tooltip.replaceChildren(heading);
+	for (let line of lines) {
+		tooltip.append(line, document.createElement('br'), document.createElement('br'));
+	}
+	tooltip.style.display = 'block';
+	tooltip.style.left = evt.pageX + 16 + 'px';
+	tooltip.style.top = evt.pageY + 16 + 'px';
+});
+
+document.addEventListener('mouseout', evt => {
+	if (regionAt(evt) !== null) {
+		document.getElementById('tooltip').style.display = 'none';
+	}
+});
+
+document.addEventListener('click', evt => {
+	let region = regionAt(evt);
+	if (region !== null && region in regionTooltips().links) {
+		document.location.href = regionTooltips().links[region];
+	}
+});
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import argparse
+import urllib.error
+import urllib.request
+import concurrent.futures
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+nyt_url = "https://raw.githubusercontent.com/nytimes/covid-19-data/master"
+arcgis_url = "https://services1.arcgis.com/CY1LXxl9zlJeBuRZ/arcgis/rest/services"
+
+def data_sources(nyt_url, arcgis_url):
+	# (file in data/, URL, whether the URL is an ArcGIS query that has to be paged)
+	today = time.strftime('%Y-%m-%d')
+	return [
+		("us.csv", f"{nyt_url}/us.csv", False),
+		("us-states.csv", f"{nyt_url}/us-states.csv", False),
+		("us-counties.csv", f"{nyt_url}/us-counties.csv", False),
+		(f"fl-zip-cases-{today}.json", f"{arcgis_url}/Florida_Cases_Zips_COVID19/FeatureServer/0/query?"
+			"where=1%3D1&outFields=ZIP,COUNTYNAME,Cases_1&returnGeometry=false&outSR=4326&f=json", True),
+		("fl-county-totals.json", f"{arcgis_url}/Florida_COVID19_Cases/FeatureServer/0/query?"
+			"where=1%3D1&outFields=COUNTY,COUNTYNAME,CasesAll,Deaths&returnGeometry=false&outSR=4326&f=json", True)]
+
+def load_validators():
+	path = os.path.join(base_dir, "cache/fetch.json")
+	if not os.path.exists(path):
+		return {}
+	return json.loads(open(path).read())
+
+def save_validators(validators):
+	os.makedirs(os.path.join(base_dir, "cache"), exist_ok=True)
+	path = os.path.join(base_dir, "cache/fetch.json")
+	open(path + ".tmp", 'w').write(json.dumps(validators, indent=1, sort_keys=True))
+	os.replace(path + ".tmp", path)
+
+def write_if_changed(name, content):
+	# Files are replaced in one rename so that a build never reads a partial download, and
+	# are left untouched when the content is the same so that the ingest cache stays valid
+	path = os.path.join(base_dir, "data", name)
+	if os.path.exists(path) and open(path, 'rb').read() == content:
+		return False
+	open(path + ".tmp", 'wb').write(content)
+	os.replace(path + ".tmp", path)
+	return True
+
+def fetch_file(name, url, validator, timeout):
+	# Sends the ETag and Last-Modified of the previous download, so that an unchanged file
+	# costs a 304 response instead of the whole download
+	request = urllib.request.Request(url)
+	if validator is not None and os.path.exists(os.path.join(base_dir, "data", name)):
+		if validator.get("etag") is not None:
+			request.add_header("If-None-Match", validator["etag"])
+		if validator.get("last_modified") is not None:
+			request.add_header("If-Modified-Since", validator["last_modified"])
+	try:
+		with urllib.request.urlopen(request, timeout=timeout) as response:
+			content = response.read()
+			validator = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+	except urllib.error.HTTPError as e:
+		if e.code == 304:
+			return False, validator
+		raise
+	return write_if_changed(name, content), validator
+
+def fetch_query(name, url, page_size, timeout):
+	# ArcGIS queries return at most a server defined number of records and set
+	# exceededTransferLimit when there are more, so pages are requested until it is unset.
+	# Query results carry no validators, unchanged results are detected by comparing them
+	# with the existing file instead.
+	result = None
+	offset = 0
+	while True:
+		with urllib.request.urlopen(f"{url}&resultOffset={offset}&resultRecordCount={page_size}",
+				timeout=timeout) as response:
+			page = json.loads(response.read())
+		if "error" in page:
+			raise ValueError(f"query failed: {page['error']}")
+		if result is None:
+			result = page
+		else:
+			result["features"] += page["features"]
+		offset += len(page["features"])
+		if not page.get("exceededTransferLimit", False) or len(page["features"]) == 0:
+			break
+	result.pop("exceededTransferLimit", None)
+	return write_if_changed(name, json.dumps(result).encode('utf-8'))
+
+def fetch_sources(sources, jobs = 5, page_size = 2000, timeout = 60):
+	# Returns the names of the files that changed and the names of the sources that failed
+	validators = load_validators()
+	changed = []
+	failed = []
+	with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+		futures = {}
+		for name, url, paged in sources:
+			if paged:
+				futures[executor.submit(fetch_query, name, url, page_size, timeout)] = name
+			else:
+				futures[executor.submit(fetch_file, name, url, validators.get(name), timeout)] = name
+		for future in concurrent.futures.as_completed(futures):
+			name = futures[future]
+			try:
+				result = future.result()
+			except Exception as e:
+				print(f"Failed to fetch {name}: {e}", file=sys.stderr)
+				failed.append(name)
+				continue
+			if isinstance(result, tuple):
+				result, validators[name] = result
+			if result:
+				changed.append(name)
+	save_validators(validators)
+	return sorted(changed), sorted(failed)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Download the NYT and FDOH data sources into data/")
+	parser.add_argument("--jobs", type=int, default=5, help="number of sources downloaded at the same time")
+	parser.add_argument("--page-size", type=int, default=2000, help="records requested per ArcGIS query page")
+	parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for a response")
+	parser.add_argument("--nyt-url", default=nyt_url, help="base URL of the NYT data repository")
+	parser.add_argument("--arcgis-url", default=arcgis_url, help="base URL of the FDOH ArcGIS services")
+	parser.add_argument("--build", action="store_true",
+		help="run an incremental build afterwards if any source changed")
+	args = parser.parse_args()
+
+	os.makedirs(os.path.join(base_dir, "data"), exist_ok=True)
+	changed, failed = fetch_sources(data_sources(args.nyt_url, args.arcgis_url), args.jobs, args.page_size,
+		args.timeout)
+	if len(changed) == 0:
+		print("No sources changed")
+	for name in changed:
+		print(f"Changed {name}")
+
+	if args.build and len(changed) != 0:
+		import generate
+		generate.Site().build(incremental=True)
+	if len(failed) != 0:
+		sys.exit(1)